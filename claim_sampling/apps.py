@@ -7,6 +7,32 @@ DEFAULT_CFG = {
     "gql_mutation_create_claim_batch_samplings_perms": ["126002"],
     "gql_mutation_update_claim_batch_samplings_perms": ["126003"],
     "gql_mutation_approve_claim_batch_samplings_perms": ["126004"],
+    "sampling_chunk_size": 5000,
+    # Upper bounds of claimed amount bands used by the 'amount_band' stratum
+    "sampling_amount_bands": [1000, 10000, 100000],
+    # Create sampling batches in a background job, progress is available in samplingBatchProgress
+    "async_batch_creation": False,
+    # Size of the local thread pool running background jobs, 0 runs them inline
+    "background_executor_workers": 2,
+    # Number of claims processed per transaction after extrapolation
+    "extrapolation_chunk_size": 500,
+    # Processes sharing the claim processing after extrapolation, 0 or 1 processes the claims in the caller
+    "extrapolation_workers": 0,
+    # Confidence level and number of bootstrap resamples of the deductible estimate
+    "estimate_confidence": 0.95,
+    "estimate_bootstrap_samples": 2000,
+    # Strata (health_facility, visit_type, care_type, amount_band) with their own deductible when extrapolating
+    # batches that were not sampled by strata, empty applies one deductible to the whole batch
+    "extrapolation_strata": [],
+    # Seconds a sampling summary and its live deductible estimate stay cached, reviews invalidate them
+    "summary_cache_ttl": 30,
+    # Default and maximum number of claims in a page of samplingBatchClaimsPage
+    "batch_claims_page_size": 100,
+    "batch_claims_max_page_size": 1000,
+    # Number of claims read from the database and written at once by batch exports
+    "export_chunk_size": 2000,
+    # Extrapolate when extrapolation tasks are resolved in a background job, the task is completed when it ends
+    "async_extrapolation": True,
 }
 
 
@@ -17,6 +43,20 @@ class ClaimSamplingConfig(AppConfig):
     gql_mutation_create_claim_batch_samplings_perms = None
     gql_mutation_update_claim_batch_samplings_perms = None
     gql_mutation_approve_claim_batch_samplings_perms = None
+    sampling_chunk_size = None
+    sampling_amount_bands = None
+    async_batch_creation = None
+    background_executor_workers = None
+    extrapolation_chunk_size = None
+    extrapolation_workers = None
+    estimate_confidence = None
+    estimate_bootstrap_samples = None
+    extrapolation_strata = None
+    summary_cache_ttl = None
+    batch_claims_page_size = None
+    batch_claims_max_page_size = None
+    export_chunk_size = None
+    async_extrapolation = None
 
     def __load_config(self, cfg):
         for field in cfg:
@@ -27,3 +67,9 @@ class ClaimSamplingConfig(AppConfig):
         from core.models import ModuleConfiguration
         cfg = ModuleConfiguration.get_or_default(MODULE_NAME, DEFAULT_CFG)
         self.__load_config(cfg)
+
+    def set_dataloaders(self, dataloaders):
+        from .dataloaders import ClaimClientMutationIdLoader, ClaimAssignmentLoader
+
+        dataloaders["claim_sampling_client_mutation_id_loader"] = ClaimClientMutationIdLoader()
+        dataloaders["claim_sampling_assignment_loader"] = ClaimAssignmentLoader()
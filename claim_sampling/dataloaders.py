@@ -0,0 +1,26 @@
+from promise.dataloader import DataLoader
+from promise import Promise
+
+from claim.models import ClaimMutation
+from .models import ClaimSamplingBatchAssignment
+
+
+class ClaimClientMutationIdLoader(DataLoader):
+    def batch_load_fn(self, keys):
+        client_mutation_ids = {}
+        claim_mutations = ClaimMutation.objects \
+            .filter(claim_id__in=keys, mutation__status=0) \
+            .order_by('id') \
+            .values_list('claim_id', 'mutation__client_mutation_id')
+        for claim_id, client_mutation_id in claim_mutations:
+            client_mutation_ids.setdefault(claim_id, client_mutation_id)
+        return Promise.resolve([client_mutation_ids.get(claim_id) for claim_id in keys])
+
+
+class ClaimAssignmentLoader(DataLoader):
+    def batch_load_fn(self, keys):
+        assignments = {
+            assignment.claim_id: assignment
+            for assignment in ClaimSamplingBatchAssignment.objects.filter(claim_id__in=keys, is_deleted=False)
+        }
+        return Promise.resolve([assignments.get(claim_id) for claim_id in keys])
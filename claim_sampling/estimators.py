@@ -0,0 +1,85 @@
+import math
+from statistics import NormalDist
+
+import numpy as np
+
+# Number of claim draws generated at once by the bootstrap, bounds its memory use
+_BOOTSTRAP_BLOCK_DRAWS = 2 ** 20
+
+
+def ratio_estimate(approved, adjusted, population=None, weights=None, confidence=0.95, bootstrap_samples=2000,
+                   seed=None):
+    """
+    Ratio estimator of the deductible, sum(approved) / sum(adjusted), over the claims reviewed in a sample.
+
+    The variance is the linearized (Taylor) variance of the ratio, computed from the residuals
+    approved - ratio * adjusted, with a finite population correction when the population size is known and the
+    sample is not weighted. Two confidence intervals are given: the normal one from that variance, and a percentile
+    bootstrap one from `bootstrap_samples` resamples of the reviewed claims. Everything is vectorized, the bootstrap
+    is run in blocks so that its memory use doesn't grow with the number of resamples.
+
+    Parameters:
+        approved (sequence): Approved amount of every reviewed claim.
+        adjusted (sequence): Adjusted amount of every reviewed claim.
+        population (int): Number of claims in the sampling batch, optional.
+        weights (sequence): Inverse inclusion probabilities of the claims for unequal probability samples
+            (monetary-unit sampling), optional.
+        confidence (float): Confidence level of the intervals.
+        bootstrap_samples (int): Number of bootstrap resamples, 0 disables the bootstrap interval.
+        seed: Seed of the bootstrap random generator, optional.
+    Returns:
+        dict: 'ratio', 'variance', 'standard_error', 'confidence', 'ci_low', 'ci_high', 'bootstrap_low',
+        'bootstrap_high' and 'sample_size', None when no claim with an adjusted amount has been reviewed.
+    """
+    approved = np.asarray(approved, dtype=float)
+    adjusted = np.asarray(adjusted, dtype=float)
+    weights = np.ones_like(adjusted) if weights is None else np.asarray(weights, dtype=float)
+    sample_size = len(adjusted)
+
+    weighted_approved, weighted_adjusted = weights * approved, weights * adjusted
+    total_adjusted = weighted_adjusted.sum()
+    if not sample_size or total_adjusted == 0:
+        return None
+    ratio = weighted_approved.sum() / total_adjusted
+
+    variance = 0.0
+    if sample_size > 1:
+        residuals = weights * (approved - ratio * adjusted)
+        variance = sample_size / (sample_size - 1) * np.square(residuals).sum() / total_adjusted ** 2
+        if population and np.all(weights == 1):
+            variance *= max(0.0, 1 - sample_size / population)
+    standard_error = math.sqrt(variance)
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+
+    bootstrap_low, bootstrap_high = None, None
+    if bootstrap_samples and sample_size > 1:
+        ratios = _bootstrap_ratios(weighted_approved, weighted_adjusted, bootstrap_samples, seed)
+        if ratios.size:
+            bootstrap_low, bootstrap_high = np.percentile(ratios, [50 * (1 - confidence), 50 * (1 + confidence)])
+
+    return {
+        'ratio': float(ratio),
+        'variance': float(variance),
+        'standard_error': standard_error,
+        'confidence': confidence,
+        'ci_low': float(ratio - z * standard_error),
+        'ci_high': float(ratio + z * standard_error),
+        'bootstrap_low': None if bootstrap_low is None else float(bootstrap_low),
+        'bootstrap_high': None if bootstrap_high is None else float(bootstrap_high),
+        'sample_size': sample_size,
+    }
+
+
+def _bootstrap_ratios(approved, adjusted, bootstrap_samples, seed=None):
+    rng = np.random.default_rng(seed)
+    sample_size = len(adjusted)
+    block = max(1, _BOOTSTRAP_BLOCK_DRAWS // sample_size)
+    ratios = []
+    for start in range(0, bootstrap_samples, block):
+        draws = rng.integers(0, sample_size, size=(min(block, bootstrap_samples - start), sample_size))
+        resampled_adjusted = adjusted[draws].sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios.append(approved[draws].sum(axis=1) / resampled_adjusted)
+    ratios = np.concatenate(ratios)
+    # Resamples without any adjusted amount have no ratio
+    return ratios[np.isfinite(ratios)]
@@ -0,0 +1,60 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+
+from django.db import connections
+
+from claim_sampling.apps import ClaimSamplingConfig
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=ClaimSamplingConfig.background_executor_workers,
+            thread_name_prefix='claim_sampling'
+        )
+    return _executor
+
+
+def submit_background_job(job, *args, **kwargs):
+    """
+    Runs `job` in the local thread pool, which stands in for a task queue. With `background_executor_workers`
+    set to 0 the job is executed inline instead.
+    """
+    if not ClaimSamplingConfig.background_executor_workers:
+        return job(*args, **kwargs)
+    return get_executor().submit(_run_job, job, *args, **kwargs)
+
+
+def map_in_processes(job, arguments, workers):
+    """
+    Runs `job(*args)` for every tuple of `arguments` in a pool of `workers` processes and returns the results in
+    order. Processes are spawned rather than forked, forking a multi-threaded server (or a worker thread of the
+    background executor) can copy locks held by other threads, so every process sets Django up again and opens its
+    own database connections. `job` has to be importable, e.g. a module-level function.
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_setup_django) as pool:
+        return list(pool.map(_run_job, repeat(job), *zip(*arguments)))
+
+
+def _setup_django():
+    import django
+    django.setup()
+
+
+def _run_job(job, *args, **kwargs):
+    try:
+        return job(*args, **kwargs)
+    except Exception as exc:
+        logger.error("Claim sampling background job %s failed", job.__name__, exc_info=exc)
+        raise
+    finally:
+        # Database connections are per thread, the ones opened by the job are not reused by Django
+        connections.close_all()
@@ -65,15 +65,37 @@ class ClaimSamplingBatchInputType(OpenIMISMutation.Input):
     # guarantee_id = ClaimGuaranteeIdInputType(required=False)
 
 
-@transaction.atomic
+CLAIM_FILTER_HANDLERS = {
+    'services': 'services__service__code__in',
+    'items': 'items__item__code__in'
+}
+
+
+@mutation_on_uuids_from_filter(Claim, ClaimGQLType, 'filters', CLAIM_FILTER_HANDLERS)
+def filtered_claim_uuids(cls, user, **data):
+    """
+    UUIDs of the claims matching JSON `filters`, the same way CreateClaimSamplingBatchMutation selects them.
+    """
+    return data['uuids']
+
+
 def update_or_create_claim_sampling_batch(data, user, task_group=None):
 
     service = ClaimSamplingService(user)
 
     if data.get('uuid', None) is not None:
-        return service.update(data)
+        with transaction.atomic():
+            return service.update(data)
+    elif ClaimSamplingConfig.async_batch_creation:
+        return service.create_async(data, task_group)
+    elif data.pop('streaming', False) and data.get('seed') is None \
+            and not data.get('strata') and not data.get('monetary_unit'):
+        # Streaming creation commits chunk by chunk, it can't run inside of a single transaction.
+        # Seeded, stratified and monetary-unit sampling have their own set-based/streamed paths.
+        return service.create_streaming(data, task_group)
     else:
-        claim_sampling_batch = service.create(data, task_group)
+        with transaction.atomic():
+            claim_sampling_batch = service.create(data, task_group)
         return claim_sampling_batch
 
 
@@ -81,11 +103,6 @@ class CreateClaimSamplingBatchMutation(OpenIMISMutation):
     """
     Create a new claim sampling batch.
     """
-    __filter_handlers = {
-        'services': 'services__service__code__in',
-        'items': 'items__item__code__in'
-    }
-
     _mutation_module = "claim_sampling"
     _mutation_class = "CreateClaimSamplingBatchMutation"
 
@@ -93,9 +110,14 @@ class CreateClaimSamplingBatchMutation(OpenIMISMutation):
         filters = graphene.String()
         percentage = graphene.Int(required=True)
         taskGroupUuid = graphene.String(required=False)
+        streaming = graphene.Boolean(required=False)
+        seed = graphene.String(required=False)
+        strata = graphene.List(graphene.String, required=False)
+        allocation = graphene.String(required=False)
+        monetary_unit = graphene.Boolean(required=False)
 
     @classmethod
-    @mutation_on_uuids_from_filter(Claim, ClaimGQLType, 'filters', __filter_handlers)
+    @mutation_on_uuids_from_filter(Claim, ClaimGQLType, 'filters', CLAIM_FILTER_HANDLERS)
     def async_mutate(cls, user, **data):
         try:
             if type(user) is AnonymousUser or not user.id:
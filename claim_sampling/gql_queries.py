@@ -1,15 +1,32 @@
 import graphene
 from core import prefix_filterset, ExtendedConnection
 from graphene_django import DjangoObjectType
+from promise import Promise
 from .apps import ClaimSamplingConfig
-from .models import Claim
+from .models import Claim, ClaimSamplingBatchAssignment
 from django.utils.translation import gettext as _
 from django.core.exceptions import PermissionDenied
 
 
+def _load_assignment(claim, info):
+    if not info.context.user.has_perms(ClaimSamplingConfig.gql_query_claim_batch_samplings_perms):
+        raise PermissionDenied(_("unauthorized"))
+    if "claim_sampling_assignment_loader" in info.context.dataloaders:
+        return info.context.dataloaders["claim_sampling_assignment_loader"].load(claim.id)
+    return Promise.resolve(ClaimSamplingBatchAssignment.objects.filter(claim=claim, is_deleted=False).first())
+
+
+def _annotated_assignment_value(claim, info, attribute):
+    if not info.context.user.has_perms(ClaimSamplingConfig.gql_query_claim_batch_samplings_perms):
+        raise PermissionDenied(_("unauthorized"))
+    return getattr(claim, attribute)
+
+
 class ClaimSamplingBatchGQLType(DjangoObjectType):
     attachments_count = graphene.Int()
     client_mutation_id = graphene.String()
+    assignment_status = graphene.String(description="Status of the claim in its sampling batch.")
+    claim_sampling_batch_id = graphene.UUID(description="Sampling batch the claim is assigned to.")
 
     class Meta:
         model = Claim
@@ -34,14 +51,27 @@ class ClaimSamplingBatchGQLType(DjangoObjectType):
     def resolve_client_mutation_id(self, info):
         if not info.context.user.has_perms(ClaimSamplingConfig.gql_query_claim_batch_samplings_perms):
             raise PermissionDenied(_("unauthorized"))
+        if "claim_sampling_client_mutation_id_loader" in info.context.dataloaders:
+            return info.context.dataloaders["claim_sampling_client_mutation_id_loader"].load(self.id)
         claim_mutation = self.mutations.select_related(
             'mutation').filter(mutation__status=0).first()
         return claim_mutation.mutation.client_mutation_id if claim_mutation else None
 
+    def resolve_assignment_status(self, info):
+        # Claims listed from a batch come annotated with their assignment, others are loaded in batches
+        if hasattr(self, 'assignment_status'):
+            return _annotated_assignment_value(self, info, 'assignment_status')
+        return _load_assignment(self, info).then(lambda assignment: assignment.status if assignment else None)
+
+    def resolve_claim_sampling_batch_id(self, info):
+        if hasattr(self, 'claim_sampling_batch_id'):
+            return _annotated_assignment_value(self, info, 'claim_sampling_batch_id')
+        return _load_assignment(self, info).then(lambda assignment: assignment.claim_batch_id if assignment else None)
+
     @classmethod
     def get_queryset(cls, queryset, info):
-        claim_ids = Claim.get_queryset(queryset, info).values('uuid').all()
-        return Claim.objects.filter(uuid__in=claim_ids)
+        # Row security restrictions are applied to the sampling query itself, as joins on the health facility
+        return Claim.get_queryset(queryset, info)
 
 
 class ClaimSamplingBatchAssignmentGQLType(DjangoObjectType):
@@ -72,8 +102,81 @@ class ClaimSamplingBatchAssignmentGQLType(DjangoObjectType):
         connection_class = ExtendedConnection
 
 
+class ClaimSamplingEstimateGQLType(graphene.ObjectType):
+    ratio = graphene.Float(description="Estimated ratio of approved to adjusted amounts - deductible.")
+    variance = graphene.Float(description="Linearized variance of the ratio.")
+    standard_error = graphene.Float()
+    confidence = graphene.Float(description="Confidence level of the intervals.")
+    ci_low = graphene.Float(description="Lower bound of the normal confidence interval.")
+    ci_high = graphene.Float(description="Upper bound of the normal confidence interval.")
+    bootstrap_low = graphene.Float(description="Lower bound of the bootstrap confidence interval.")
+    bootstrap_high = graphene.Float(description="Upper bound of the bootstrap confidence interval.")
+    sample_size = graphene.Int(description="Number of reviewed claims the estimate is based on.")
+
+
 class ClaimSamplingSummaryGQLType(graphene.ObjectType):
     deductible_percentage = graphene.Float(description="Percentage of claims rejected during review - deductibles.")
     reviewed_percentage = graphene.Float(description="Percentage of reviewed claims in batch.")
     total_claims_in_batch = graphene.Int(description="Total number of claims selected for review in sampling batch")
+    estimate = graphene.Field(ClaimSamplingEstimateGQLType, description="Deductible estimate with its uncertainty.")
+
+
+class ClaimSamplingBatchSummaryGQLType(graphene.ObjectType):
+    claim_sampling_id = graphene.UUID()
+    task_id = graphene.UUID(description="Task of the extrapolation of the batch.")
+    total = graphene.Int(description="Number of claims selected for review.")
+    reviewed = graphene.Int(description="Number of claims selected for review that were reviewed.")
+    delivered = graphene.Int(description="Number of claims with a delivered review.")
+    rejected = graphene.Int(description="Number of claims rejected during review.")
+    claimed = graphene.Float(description="Claimed amount of the claims selected for review.")
+    approved = graphene.Float(description="Approved amount of the claims with a delivered review.")
+    deductible_percentage = graphene.Float(description="Percentage of claims rejected during review - deductibles.")
+    reviewed_percentage = graphene.Float(description="Percentage of reviewed claims in batch.")
+
+
+class ClaimSamplingBatchProgressGQLType(graphene.ObjectType):
+    status = graphene.String(description="QUEUED, RUNNING, COMPLETED or FAILED.")
+    scanned = graphene.Int(description="Number of filtered claims read so far.")
+    assigned = graphene.Int(description="Number of claims assigned to the batch so far.")
+    selected = graphene.Int(description="Number of claims selected for review so far.")
+    error = graphene.String(description="Reason of the failure of batch creation.")
+
+
+class ClaimSamplingPreviewStratumGQLType(graphene.ObjectType):
+    key = graphene.types.json.JSONString(description="Values of the stratum keys.")
+    population = graphene.Int(description="Number of claims in the stratum.")
+    sample = graphene.Int(description="Number of claims of the stratum that would be reviewed.")
+    claimed = graphene.Float(description="Claimed amount of the stratum.")
+    claimed_in_review = graphene.Float(description="Expected claimed amount of the stratum in review.")
+
+
+class ClaimSamplingPreviewGQLType(graphene.ObjectType):
+    matched = graphene.Int(description="Number of claims matching the filters.")
+    already_assigned = graphene.Int(description="Number of matching claims already assigned to a sampling batch.")
+    to_assign = graphene.Int(description="Number of claims that would be assigned to the batch.")
+    sample_size = graphene.Int(description="Number of claims that would be selected for review.")
+    claimed_in_review = graphene.Float(description="Expected claimed amount of the claims selected for review.")
+    claimed_skipped = graphene.Float(description="Expected claimed amount of the claims skipped from review.")
+    strata = graphene.List(ClaimSamplingPreviewStratumGQLType, description="Allocation of stratified sampling.")
+
+
+class ClaimSamplingSimulationRowGQLType(graphene.ObjectType):
+    health_facility_id = graphene.Int()
+    product_id = graphene.Int()
+    adjusted = graphene.Float(description="Adjusted amount of the claims to extrapolate.")
+    current_approved = graphene.Float(description="Currently approved amount of the claims to extrapolate.")
+    projected_approved = graphene.List(graphene.Float, description="Projected approved amount, per deductible.")
+
+
+class ClaimSamplingSimulationGQLType(graphene.ObjectType):
+    deductibles = graphene.List(graphene.Float, description="Simulated deductibles.")
+    adjusted = graphene.Float(description="Adjusted amount of the claims to extrapolate.")
+    current_approved = graphene.Float(description="Currently approved amount of the claims to extrapolate.")
+    projected_approved = graphene.List(graphene.Float, description="Projected approved amount, per deductible.")
+    breakdown = graphene.List(ClaimSamplingSimulationRowGQLType, description="Totals by health facility and product.")
+
 
+class ClaimSamplingClaimsPageGQLType(graphene.ObjectType):
+    claims = graphene.List(ClaimSamplingBatchGQLType, description="Claims of the page.")
+    end_cursor = graphene.String(description="Cursor of the last claim of the page, to pass as 'after'.")
+    has_next_page = graphene.Boolean()
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.10 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("claim_sampling", "0006_alter_claimsamplingbatchassignment_claim_and_more"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="claimsamplingbatchassignment",
+            index=models.Index(
+                fields=["claim_batch", "status"], name="csba_batch_status_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="claimsamplingbatchassignment",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("is_deleted", False)),
+                fields=("claim",),
+                name="csba_unique_active_claim",
+            ),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.10 on 2026-10-17 11:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("claim_sampling", "0007_claimsamplingbatchassignment_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ClaimSamplingSnapshot",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("C", "Claim"), ("I", "Item"), ("S", "Service")],
+                        max_length=1,
+                    ),
+                ),
+                ("row_id", models.IntegerField()),
+                (
+                    "amount",
+                    models.DecimalField(
+                        blank=True, decimal_places=2, max_digits=18, null=True
+                    ),
+                ),
+                ("review_status", models.SmallIntegerField(blank=True, null=True)),
+                (
+                    "claim_batch",
+                    models.ForeignKey(
+                        db_column="ClaimSamplingBatchID",
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="snapshots",
+                        to="claim_sampling.claimsamplingbatch",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="claimsamplingsnapshot",
+            index=models.Index(
+                fields=["claim_batch", "kind", "row_id"], name="css_batch_kind_row_idx"
+            ),
+        ),
+    ]
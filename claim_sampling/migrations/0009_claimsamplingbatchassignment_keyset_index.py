@@ -0,0 +1,24 @@
+# Generated by Django 4.2.10 on 2026-10-17 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("claim_sampling", "0008_claimsamplingsnapshot"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="claimsamplingbatchassignment",
+            name="csba_batch_status_idx",
+        ),
+        migrations.AddIndex(
+            model_name="claimsamplingbatchassignment",
+            index=models.Index(
+                fields=["claim_batch", "status", "claim"],
+                name="csba_batch_status_claim_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.10 on 2026-10-17 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("claim_sampling", "0009_claimsamplingbatchassignment_keyset_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="claimsamplingsnapshot",
+            name="status",
+            field=models.SmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="claimsamplingsnapshot",
+            name="valuated",
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.10 on 2026-10-17 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("claim_sampling", "0010_claimsamplingsnapshot_status_valuated"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="claimsamplingsnapshot",
+            name="process_stamp",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="claimsamplingsnapshot",
+            name="date_processed",
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="claimsamplingsnapshot",
+            name="audit_user_id_process",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -28,3 +28,48 @@ class ClaimSamplingBatchAssignment(HistoryModel):
         choices=ClaimSamplingBatchAssignmentStatus.choices,
         default=ClaimSamplingBatchAssignmentStatus.IDLE
     )
+
+    class Meta:
+        constraints = [
+            # A claim can be part of only one active sampling batch
+            models.UniqueConstraint(
+                fields=['claim'],
+                condition=models.Q(is_deleted=False),
+                name='csba_unique_active_claim'
+            ),
+        ]
+        indexes = [
+            # Also serves the (status, claim) keyset of pages of batch claims without reading the claims
+            models.Index(fields=['claim_batch', 'status', 'claim'], name='csba_batch_status_claim_idx'),
+        ]
+
+
+class ClaimSamplingSnapshotKind(models.TextChoices):
+    CLAIM = "C"
+    ITEM = "I"
+    SERVICE = "S"
+
+
+class ClaimSamplingSnapshot(models.Model):
+    """
+    Value of a claim, claim item or claim service before it was overwritten by the extrapolation of a batch, used
+    to roll the extrapolation back. `amount` is the approved amount of a claim or the approved price of an item or
+    service. Review status, status, valuated amount and processing stamps are only kept for claims.
+    """
+    id = models.BigAutoField(primary_key=True)
+    claim_batch = models.ForeignKey(ClaimSamplingBatch, models.DO_NOTHING, db_column='ClaimSamplingBatchID',
+                                    related_name="snapshots")
+    kind = models.CharField(max_length=1, choices=ClaimSamplingSnapshotKind.choices)
+    row_id = models.IntegerField()
+    amount = models.DecimalField(max_digits=18, decimal_places=2, blank=True, null=True)
+    review_status = models.SmallIntegerField(blank=True, null=True)
+    status = models.SmallIntegerField(blank=True, null=True)
+    valuated = models.DecimalField(max_digits=18, decimal_places=2, blank=True, null=True)
+    process_stamp = models.DateTimeField(blank=True, null=True)
+    date_processed = models.DateField(blank=True, null=True)
+    audit_user_id_process = models.IntegerField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['claim_batch', 'kind', 'row_id'], name='css_batch_kind_row_idx'),
+        ]
@@ -1,15 +1,19 @@
 from enum import Enum
 
-from django.db.models import OuterRef, Subquery, Avg, Q
+from django.db.models import F, OuterRef, Subquery, Avg, Q
 import graphene_django_optimizer as gql_optimizer
-from core.schema import OrderedDjangoFilterConnectionField
+from core.schema import OrderedDjangoFilterConnectionField, signal_mutation_module_after_mutating
 from core import filter_validity
 from django.conf import settings
-from claim_sampling.gql_queries import ClaimSamplingSummaryGQLType, ClaimSamplingBatchGQLType, ClaimSamplingBatchAssignmentGQLType
+from claim_sampling.gql_queries import ClaimSamplingSummaryGQLType, ClaimSamplingBatchGQLType, \
+    ClaimSamplingBatchAssignmentGQLType, ClaimSamplingBatchProgressGQLType, ClaimSamplingPreviewGQLType, \
+    ClaimSamplingPreviewStratumGQLType, ClaimSamplingEstimateGQLType, ClaimSamplingSimulationGQLType, \
+    ClaimSamplingSimulationRowGQLType, ClaimSamplingClaimsPageGQLType, ClaimSamplingBatchSummaryGQLType
 from django.utils.translation import gettext as _
 from claim_sampling.gql_mutations import *  # lgtm [py/polluting-import]
 
 from claim_sampling.models import ClaimSamplingBatch, ClaimSamplingBatchAssignment
+from claim_sampling.signals import on_claim_review_after_mutation
 from claim.models import Claim
 from tasks_management.models import Task
 
@@ -26,17 +30,60 @@ class Query(graphene.ObjectType):
     )
 
     sampling_batch_claims = OrderedDjangoFilterConnectionField(
-        ClaimGQLType,
+        ClaimSamplingBatchGQLType,
         claim_sampling_id=graphene.UUID(required=True),
         assignment_status=graphene.String()
     )
 
+    sampling_batch_claims_page = graphene.Field(
+        ClaimSamplingClaimsPageGQLType,
+        claim_sampling_id=graphene.UUID(required=True),
+        assignment_status=graphene.String(),
+        first=graphene.Int(),
+        after=graphene.String(),
+        description="Keyset paginated claims of a sampling batch, ordered by assignment status and claim id."
+    )
+
     sampling_summary = graphene.Field(
         ClaimSamplingSummaryGQLType,
         task_id=graphene.String(required=True),
         description="Provide details regarding claim sampling assigned to specific task."
     )
 
+    sampling_summaries = graphene.List(
+        ClaimSamplingBatchSummaryGQLType,
+        claim_sampling_ids=graphene.List(graphene.UUID),
+        task_ids=graphene.List(graphene.UUID),
+        date_from=graphene.DateTime(),
+        date_to=graphene.DateTime(),
+        description="Review summaries of the given batches, of the batches of the given tasks and of the batches "
+                    "created in the date range."
+    )
+
+    sampling_batch_progress = graphene.Field(
+        ClaimSamplingBatchProgressGQLType,
+        claim_sampling_id=graphene.UUID(required=True),
+        description="Progress of the creation of a claim sampling batch."
+    )
+
+    sampling_batch_preview = graphene.Field(
+        ClaimSamplingPreviewGQLType,
+        filters=graphene.String(required=True),
+        percentage=graphene.Int(required=True),
+        strata=graphene.List(graphene.String),
+        allocation=graphene.String(),
+        monetary_unit=graphene.Boolean(),
+        description="Dry run of createClaimSamplingBatch, nothing is created."
+    )
+
+    sampling_extrapolation_simulation = graphene.Field(
+        ClaimSamplingSimulationGQLType,
+        claim_sampling_id=graphene.UUID(required=True),
+        deductibles=graphene.List(graphene.Float),
+        description="Projected approved amounts of the extrapolation of a batch for several deductibles, "
+                    "nothing is updated."
+    )
+
     def resolve_claim_sampling_batch(self, info, **kwargs):
         if (
             not info.context.user.has_perms(ClaimSamplingConfig.gql_query_claim_batch_samplings_perms)
@@ -67,21 +114,41 @@ class Query(graphene.ObjectType):
             raise PermissionDenied(_("unauthorized"))
 
         sampling = ClaimSamplingBatch.objects.get(uuid=kwargs['claim_sampling_id'])
-        relevant_claims = ClaimSamplingBatchAssignment.objects.filter(claim_batch=sampling)
+        assignment_filters = {'assignments__claim_batch': sampling, 'assignments__is_deleted': False}
 
         claim_assignment_status = kwargs.get('assignment_status')
 
         if claim_assignment_status:
-            relevant_claims = relevant_claims.filter(status=claim_assignment_status)
+            assignment_filters['assignments__status'] = claim_assignment_status
 
-        # All claims are displayed but
+        # Claims are joined to their assignment, id keeps the order of claims with the same status stable. Ordered by
+        # claim status as before, unlike samplingBatchClaimsPage this order is not served by the assignments index
         query = Claim.objects.filter(
-            id__in=relevant_claims.values_list('claim_id', flat=True),
-            validity_to__isnull=True  # Ensuring that only valid (non-expired) claims are returned
-        ).order_by('status')
+            validity_to__isnull=True,  # Ensuring that only valid (non-expired) claims are returned
+            **assignment_filters
+        ).annotate(
+            assignment_status=F('assignments__status'),
+            claim_sampling_batch_id=F('assignments__claim_batch_id')
+        ).order_by('status', 'id')
 
         return query
 
+    def resolve_sampling_batch_claims_page(self, info, **kwargs):
+        if (
+            not info.context.user.has_perms(ClaimSamplingConfig.gql_query_claim_batch_samplings_perms)
+            and settings.ROW_SECURITY
+        ):
+            raise PermissionDenied(_("unauthorized"))
+
+        claims, end_cursor, has_next_page = ClaimSamplingService(user=info.context.user).get_batch_claims_page(
+            ClaimSamplingBatch.objects.get(uuid=kwargs['claim_sampling_id']).id,
+            assignment_status=kwargs.get('assignment_status'),
+            first=kwargs.get('first'),
+            after=kwargs.get('after'),
+            claims=Claim.get_queryset(None, info.context.user)
+        )
+        return ClaimSamplingClaimsPageGQLType(claims=claims, end_cursor=end_cursor, has_next_page=has_next_page)
+
     def resolve_sampling_summary(self, info, **kwargs):
         if not info.context.user.has_perms(ClaimSamplingConfig.gql_query_claim_batch_samplings_perms):
             raise PermissionDenied(_("unauthorized"))
@@ -92,16 +159,18 @@ class Query(graphene.ObjectType):
             claim_sampling_id = task.data['data']['uuid']
 
             claim_sampling_service = ClaimSamplingService(user=info.context.user)
-            rejected_from_review, reviewed_delivered, total = claim_sampling_service.prepare_sampling_summary(
-                claim_sampling_id)
+            summary = claim_sampling_service.get_sampling_summary(claim_sampling_id)
+            total = summary['total']
+
+            review_delivered, percentage = _summary_percentages(summary)
 
-            review_delivered = round(reviewed_delivered.count()/total, 2)*100
-            percentage = round(rejected_from_review.count()/total, 2)*100
+            estimate = claim_sampling_service.get_deductible_estimate(claim_sampling_id)
 
             return ClaimSamplingSummaryGQLType(
                 deductible_percentage=percentage,
                 reviewed_percentage=review_delivered,
-                total_claims_in_batch=total
+                total_claims_in_batch=total,
+                estimate=ClaimSamplingEstimateGQLType(**estimate) if estimate else None
             )
         except Exception as e:
             if settings.DEBUG:
@@ -109,8 +178,90 @@ class Query(graphene.ObjectType):
                 traceback.print_exc()
             raise e
 
+    def resolve_sampling_summaries(self, info, **kwargs):
+        if not info.context.user.has_perms(ClaimSamplingConfig.gql_query_claim_batch_samplings_perms):
+            raise PermissionDenied(_("unauthorized"))
+
+        claim_sampling_ids = {str(claim_sampling_id) for claim_sampling_id in kwargs.get('claim_sampling_ids') or []}
+        if kwargs.get('task_ids'):
+            claim_sampling_ids.update(Task.objects.filter(
+                id__in=kwargs['task_ids'], source='claim_sampling'
+            ).values_list('entity_id', flat=True))
+        if kwargs.get('date_from') or kwargs.get('date_to'):
+            batches = ClaimSamplingBatch.objects.filter(is_deleted=False)
+            if kwargs.get('date_from'):
+                batches = batches.filter(date_created__gte=kwargs['date_from'])
+            if kwargs.get('date_to'):
+                batches = batches.filter(date_created__lte=kwargs['date_to'])
+            claim_sampling_ids.update(
+                str(claim_sampling_id) for claim_sampling_id in batches.values_list('id', flat=True))
+        if not claim_sampling_ids:
+            return []
+
+        task_ids = dict(Task.objects.filter(
+            source='claim_sampling', entity_id__in=claim_sampling_ids
+        ).values_list('entity_id', 'id'))
+        summaries = ClaimSamplingService(user=info.context.user).get_sampling_summaries(sorted(claim_sampling_ids))
+        result = []
+        for claim_sampling_id, summary in summaries.items():
+            reviewed_percentage, deductible_percentage = _summary_percentages(summary)
+            result.append(ClaimSamplingBatchSummaryGQLType(
+                claim_sampling_id=claim_sampling_id,
+                task_id=task_ids.get(claim_sampling_id),
+                reviewed_percentage=reviewed_percentage,
+                deductible_percentage=deductible_percentage,
+                **summary
+            ))
+        return result
+
+    def resolve_sampling_batch_progress(self, info, **kwargs):
+        if not info.context.user.has_perms(ClaimSamplingConfig.gql_query_claim_batch_samplings_perms):
+            raise PermissionDenied(_("unauthorized"))
+
+        progress = ClaimSamplingService(user=info.context.user).get_progress(kwargs['claim_sampling_id'])
+        return ClaimSamplingBatchProgressGQLType(**progress)
+
+    def resolve_sampling_batch_preview(self, info, **kwargs):
+        if not info.context.user.has_perms(ClaimSamplingConfig.gql_query_claim_batch_samplings_perms):
+            raise PermissionDenied(_("unauthorized"))
+
+        user = info.context.user
+        kwargs['uuids'] = filtered_claim_uuids(None, user, filters=kwargs['filters'])
+        preview = ClaimSamplingService(user=user).preview(kwargs)
+        strata = preview.pop('strata')
+        return ClaimSamplingPreviewGQLType(
+            **preview,
+            strata=[ClaimSamplingPreviewStratumGQLType(**stratum) for stratum in strata] if strata else None
+        )
+
+    def resolve_sampling_extrapolation_simulation(self, info, **kwargs):
+        if not info.context.user.has_perms(ClaimSamplingConfig.gql_query_claim_batch_samplings_perms):
+            raise PermissionDenied(_("unauthorized"))
+
+        simulation = ClaimSamplingService(user=info.context.user).simulate_extrapolation(
+            kwargs['claim_sampling_id'], kwargs.get('deductibles'))
+        breakdown = simulation.pop('breakdown')
+        return ClaimSamplingSimulationGQLType(
+            **simulation,
+            breakdown=[ClaimSamplingSimulationRowGQLType(**row) for row in breakdown]
+        )
+
+
+def _summary_percentages(summary):
+    """
+    Percentages of claims selected for review with a delivered review and rejected in review.
+    """
+    total = summary['total']
+    if not total:
+        return 0, 0
+    return round(summary['delivered']/total, 2)*100, round(summary['rejected']/total, 2)*100
+
 
 class Mutation(graphene.ObjectType):
     create_claim_sampling_batch = CreateClaimSamplingBatchMutation.Field()
     update_claim_sampling_batch = UpdateClaimSamplingBatchMutation.Field()
     approve_claim_sampling_batch = ApproveClaimSamplingBatchMutation.Field()
+
+
+def bind_signals():
+    signal_mutation_module_after_mutating["claim"].connect(on_claim_review_after_mutation)
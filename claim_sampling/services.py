@@ -1,32 +1,41 @@
+import base64
+import datetime
+import logging
 import random
 import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from copy import copy
 from typing import List
 
-from claim.apps import ClaimConfig
 from claim.models import (
-    Claim, ClaimItem, ClaimService, 
+    Claim, ClaimDetail, ClaimItem, ClaimService,
 )
-    
-from enum import Enum
 from django.db.models import (
-    OuterRef, Subquery, Avg, Q, Sum, F, ExpressionWrapper, 
-    FloatField, DecimalField,  Subquery, OuterRef, Case, Value, When
+    OuterRef, Subquery, Q, Sum, F, ExpressionWrapper, FloatField, DecimalField, Case, Value, When, CharField, Count,
+    IntegerField, StdDev, Window, Exists
 )
-from django.db.models.functions import Coalesce
-from django.db import transaction
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Concat, Least, MD5
+from django.core.cache import cache
+from django.db import connection, transaction
 from django.utils.translation import gettext as _
 
 from claim.services import (
-    set_claims_status, update_claims_dedrems, processing_claim,
+    set_claims_status, processing_claim,
 )
-from claim.subqueries import (   
-    total_srv_adjusted_exp, total_itm_adjusted_exp,
-    total_srv_approved_exp, total_itm_approved_exp,elm_approved_exp,update_claim_approved, elm_adjusted_exp,elm_approved_exp
+from claim.subqueries import (
+    elm_approved_exp, elm_adjusted_exp, elm_qty_exp,
 )
+from claim_sampling.apps import ClaimSamplingConfig
+from claim_sampling.estimators import ratio_estimate
+from claim_sampling.executors import map_in_processes, submit_background_job
 from claim_sampling.models import (
     ClaimSamplingBatch,
     ClaimSamplingBatchAssignment,
-    ClaimSamplingBatchAssignmentStatus
+    ClaimSamplingBatchAssignmentStatus,
+    ClaimSamplingSnapshot,
+    ClaimSamplingSnapshotKind
 )
 from core.services import BaseService
 from core.signals import register_service_signal
@@ -36,6 +45,314 @@ from tasks_management.apps import TasksManagementConfig
 from tasks_management.models import Task, TaskGroup
 from tasks_management.services import TaskService, _get_std_task_data_payload
 
+logger = logging.getLogger(__name__)
+
+
+def _history_copy(instance, validity_to, **overrides):
+    """
+    Unsaved copy of a versioned row, as created by VersionedModel.save_history(), ready for bulk_create.
+    """
+    histo = copy(instance)
+    histo.id = None
+    if hasattr(histo, "uuid"):
+        histo.uuid = uuid.uuid4()
+    histo.validity_to = validity_to
+    histo.legacy_id = instance.id
+    for field, value in overrides.items():
+        setattr(histo, field, value)
+    return histo
+
+
+# SQL generating primary keys of assignments inserted with INSERT ... SELECT
+_NEW_UUID_SQL = {
+    'postgresql': 'gen_random_uuid()',
+    'microsoft': 'NEWID()',
+}
+
+
+@contextmanager
+def _temporary_claim_factors(factors):
+    """
+    Temporary table (claim_id, factor) filled with `factors` on the current connection, dropped on exit. Meant to be
+    used inside of a transaction.
+    """
+    if connection.vendor == 'microsoft':
+        table, create_sql = '#claim_sampling_factors', 'CREATE TABLE'
+    else:
+        table, create_sql = 'claim_sampling_factors', 'CREATE TEMPORARY TABLE'
+    with connection.cursor() as cursor:
+        cursor.execute(f"{create_sql} {table} (claim_id INT PRIMARY KEY, factor DECIMAL(18, 6))")
+        try:
+            for chunk in _chunked(factors.items(), ClaimSamplingConfig.sampling_chunk_size):
+                cursor.executemany(f"INSERT INTO {table} (claim_id, factor) VALUES (%s, %s)", chunk)
+            yield table
+        finally:
+            cursor.execute(f"DROP TABLE {table}")
+
+
+def _sample_hash_expression(seed):
+    return MD5(Concat('uuid', Value(seed), output_field=CharField()))
+
+
+STRATIFIED_ALLOCATION_PROPORTIONAL = 'proportional'
+STRATIFIED_ALLOCATION_NEYMAN = 'neyman'
+
+
+def _stratum_column(key):
+    return f'stratum_{key}'
+
+
+def _stratum_expressions(keys, prefix=''):
+    """
+    Annotations placing a claim in a stratum, one per stratum key. `prefix` is the path to the claim when annotating
+    a related model, e.g. 'claim__' for claim items.
+    """
+    bands = ClaimSamplingConfig.sampling_amount_bands
+    expressions = {
+        'health_facility': F(f'{prefix}health_facility_id'),
+        'visit_type': F(f'{prefix}visit_type'),
+        'care_type': F(f'{prefix}care_type'),
+        'amount_band': Case(
+            *[When(**{f'{prefix}claimed__lt': upper_bound}, then=Value(band))
+              for band, upper_bound in enumerate(bands)],
+            default=Value(len(bands)),
+            output_field=IntegerField()
+        ),
+    }
+    unknown_keys = set(keys) - set(expressions)
+    if unknown_keys:
+        raise ValueError(_("Unknown strata: %s") % ', '.join(sorted(unknown_keys)))
+    return {_stratum_column(key): expressions[key] for key in keys}
+
+
+def _validate_sampling_options(options):
+    """
+    Rejects sampling options that can't be combined: monetary-unit sampling draws claims by claimed amount over the
+    whole claim set, it can't be allocated across strata.
+    """
+    if options.get('monetary_unit') and options.get('strata'):
+        raise ValueError(_("Monetary-unit sampling can't be combined with strata"))
+
+
+def allocate_stratified_sample(strata, sample_size, allocation=STRATIFIED_ALLOCATION_PROPORTIONAL):
+    """
+    Splits `sample_size` across strata, proportionally to stratum population or with Neyman allocation
+    (population * standard deviation of the claimed amount). Every stratum gets at least one claim, no stratum
+    gets more claims than it has, and rounding leftovers go to the largest remainders. The allocations never add up
+    to more than `sample_size`: claims given above the quotas to satisfy the minimum of one per stratum are taken
+    back from the strata exceeding their quota the most, and when there are more strata than claims to select, the
+    strata with the smallest quotas get none.
+
+    Parameters:
+        strata (list): Dicts with 'population' (int) and, for Neyman allocation, 'stddev' (number or None).
+        sample_size (int): Total number of claims to be selected for review.
+        allocation (str): 'proportional' or 'neyman'.
+    Returns:
+        list: Number of claims to review in each stratum, in the order of `strata`.
+    """
+    if allocation not in (STRATIFIED_ALLOCATION_PROPORTIONAL, STRATIFIED_ALLOCATION_NEYMAN):
+        raise ValueError(_("Unknown allocation: %s") % allocation)
+
+    populations = [stratum['population'] for stratum in strata]
+    weights = populations
+    if allocation == STRATIFIED_ALLOCATION_NEYMAN:
+        weights = [stratum['population'] * float(stratum.get('stddev') or 0) for stratum in strata]
+        if not any(weights):
+            weights = populations
+    total_weight = float(sum(weights))
+
+    quotas = [sample_size * weight / total_weight for weight in weights]
+    allocations = [min(population, max(1, int(quota))) for population, quota in zip(populations, quotas)]
+
+    excess = sum(allocations) - sample_size
+    while excess > 0:
+        # Strata keep their first claim as long as others have more than one
+        index = max((index for index, allocated in enumerate(allocations) if allocated),
+                    key=lambda index: (allocations[index] > 1, allocations[index] - quotas[index]))
+        allocations[index] -= 1
+        excess -= 1
+
+    by_remainder = sorted(range(len(strata)), key=lambda index: quotas[index] - int(quotas[index]), reverse=True)
+    remaining = sample_size - sum(allocations)
+    while remaining > 0 and any(allocated < population for allocated, population in zip(allocations, populations)):
+        for index in by_remainder:
+            if remaining == 0:
+                break
+            if allocations[index] < populations[index]:
+                allocations[index] += 1
+                remaining -= 1
+    return allocations
+
+
+def _details_subtotal_exp(detail_model, expression):
+    """
+    Per-claim subtotal of claim items or services, grouped in a correlated subquery so that annotating several
+    subtotals on the same claim queryset doesn't multiply rows.
+    """
+    return Coalesce(Subquery(
+        detail_model.objects.filter(claim=OuterRef('pk'), *filter_validity())
+        .values('claim_id').annotate(subtotal=Sum(expression)).values('subtotal').order_by()[:1],
+        output_field=DecimalField()
+    ), Value(0), output_field=DecimalField())
+
+
+def _detail_approved_exp():
+    return Case(
+        When(Q(claim__status=Claim.STATUS_REJECTED) | Q(status=ClaimDetail.STATUS_REJECTED), then=Value(0.0)),
+        default=elm_approved_exp(),
+        output_field=DecimalField()
+    )
+
+
+def _review_totals_annotations():
+    """
+    Approved and adjusted subtotals of the items and services of a claim, as annotations.
+    """
+    return {
+        'itm_approved': _details_subtotal_exp(ClaimItem, _detail_approved_exp()),
+        'srv_approved': _details_subtotal_exp(ClaimService, _detail_approved_exp()),
+        'itm_adjusted': _details_subtotal_exp(ClaimItem, elm_adjusted_exp()),
+        'srv_adjusted': _details_subtotal_exp(ClaimService, elm_adjusted_exp()),
+    }
+
+
+def _claim_approved_exp():
+    return _details_subtotal_exp(ClaimItem, _detail_approved_exp()) + \
+        _details_subtotal_exp(ClaimService, _detail_approved_exp())
+
+
+def _update_claims_approved(claims, **updates):
+    """
+    Recomputes the approved amount of `claims` as the sum of the approved amounts of all their valid items and
+    services, with a single UPDATE.
+    """
+    claims.update(approved=_claim_approved_exp(), **updates)
+
+
+def _claim_adjusted_exp():
+    return _details_subtotal_exp(ClaimItem, elm_adjusted_exp()) + \
+        _details_subtotal_exp(ClaimService, elm_adjusted_exp())
+
+
+SAMPLING_PROGRESS_QUEUED = 'QUEUED'
+SAMPLING_PROGRESS_RUNNING = 'RUNNING'
+SAMPLING_PROGRESS_COMPLETED = 'COMPLETED'
+SAMPLING_PROGRESS_FAILED = 'FAILED'
+
+
+def _merge_computed_value(claim_sampling_id, key, values):
+    """
+    Merges `values` into computed_value[key] of a sampling batch. The batch row is locked for the read-modify-write,
+    and it is updated directly so that frequent bookkeeping writes don't create new versions of the batch.
+    """
+    with transaction.atomic():
+        computed_value = ClaimSamplingBatch.objects.select_for_update().filter(id=claim_sampling_id)\
+            .values_list('computed_value', flat=True).first() or {}
+        computed_value[key] = {**computed_value.get(key, {}), **values}
+        ClaimSamplingBatch.objects.filter(id=claim_sampling_id).update(computed_value=computed_value)
+
+
+def get_sampling_batch(claim_sampling_id):
+    """
+    Loads a sampling batch with its current computed_value. computed_value is written with queryset updates (see
+    `_merge_computed_value`) which bypass the cache of the model manager, so the cached instance can be stale.
+    """
+    claim_sampling = ClaimSamplingBatch.objects.get(id=claim_sampling_id)
+    claim_sampling.refresh_from_db(fields=['computed_value'])
+    return claim_sampling
+
+
+# Running review statistics of a batch, kept in computed_value['statistics'] over the claims selected for review
+STATISTICS_COUNTERS = (
+    'reviewed', 'delivered', 'rejected', 'approved',
+    'items_approved', 'services_approved', 'items_adjusted', 'services_adjusted'
+)
+
+# Status of the extrapolation of a task, kept in json_ext['extrapolation'] of the task
+TASK_EXTRAPOLATION_QUEUED = 'QUEUED'
+TASK_EXTRAPOLATION_RUNNING = 'RUNNING'
+TASK_EXTRAPOLATION_COMPLETED = 'COMPLETED'
+TASK_EXTRAPOLATION_FAILED = 'FAILED'
+
+# Claim fields kept in extrapolation snapshots besides the approved amount, under the same name
+CLAIM_SNAPSHOT_FIELDS = (
+    'review_status', 'status', 'valuated', 'process_stamp', 'date_processed', 'audit_user_id_process'
+)
+
+EXTRAPOLATION_PROCESSING = 'PROCESSING'
+EXTRAPOLATION_COMPLETED = 'COMPLETED'
+EXTRAPOLATION_ROLLED_BACK = 'ROLLED_BACK'
+
+
+def _record_extrapolation_watermark(claim_sampling_id, range_index, watermark):
+    """
+    Records the last claim id processed in a range of the extrapolation checkpoint. Meant to be called in the
+    transaction of the processed chunk, so that the watermark is committed together with the claims.
+    """
+    computed_value = ClaimSamplingBatch.objects.select_for_update().filter(id=claim_sampling_id)\
+        .values_list('computed_value', flat=True).first()
+    computed_value['extrapolation']['ranges'][range_index]['watermark'] = watermark
+    ClaimSamplingBatch.objects.filter(id=claim_sampling_id).update(computed_value=computed_value)
+
+
+def _summary_cache_key(claim_sampling_id):
+    return f'claim_sampling_summary_{claim_sampling_id}'
+
+
+def _estimate_cache_key(claim_sampling_id):
+    return f'claim_sampling_estimate_{claim_sampling_id}'
+
+
+def invalidate_sampling_summaries(claim_sampling_ids):
+    cache.delete_many([cache_key(claim_sampling_id) for claim_sampling_id in claim_sampling_ids
+                       for cache_key in (_summary_cache_key, _estimate_cache_key)])
+
+
+# Columns of batch exports and the claim fields they are read from
+BATCH_EXPORT_COLUMNS = (
+    'claim_uuid', 'claim_code', 'assignment_status', 'status', 'review_status', 'claimed', 'approved', 'adjusted'
+)
+BATCH_EXPORT_FIELDS = (
+    'uuid', 'code', 'assignment_status', 'status', 'review_status', 'claimed', 'approved', 'adjusted'
+)
+
+
+def _encode_claims_cursor(assignment_status, claim_id):
+    return base64.urlsafe_b64encode(f"{assignment_status}:{claim_id}".encode()).decode()
+
+
+def _decode_claims_cursor(cursor):
+    try:
+        assignment_status, claim_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        return assignment_status, int(claim_id)
+    except ValueError:
+        raise ValueError(_("Invalid cursor: %s") % cursor)
+
+
+def _uses_dedicated_sampling(options):
+    return options.get('seed') is not None or options.get('strata') or options.get('monetary_unit')
+
+
+def _chunked(iterable, chunk_size):
+    chunk = []
+    for element in iterable:
+        chunk.append(element)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _process_claims_worker(user_id, claim_sampling_id, range_index, id_range):
+    """
+    Entry point of an extrapolation worker process, processes the CHECKED claims of the batch in `id_range`.
+    """
+    from core.models import User
+    service = ClaimSamplingService(User.objects.get(id=user_id))
+    claims = Claim.objects.filter(*filter_validity(), assignments__claim_batch_id=claim_sampling_id)
+    return service._process_checked_claims(claim_sampling_id, claims, range_index, id_range)
+
 
 class IndividualDataSourceValidation(BaseModelValidation):
     OBJECT_TYPE = ClaimSamplingBatch
@@ -55,11 +372,19 @@ class ClaimSamplingService(BaseService):
         2. Determines which claims should be selected for review based on the given percentage.
         3. Creates assignments for each claim in the batch, tagging them with the appropriate review status.
         4. Saves all assignments in bulk to the database.
+        5. Marks the claims selected for review as REVIEW_SELECTED with a bulk history insert and a bulk update.
 
         Parameters:
             obj_data (dict): A dictionary containing:
                 - 'percentage': The percentage of claims that should be selected for review (int).
                 - 'uuids': A QuerySet of claim UUIDs that should be considered for sampling (QuerySet).
+                - 'seed': Optional (str). When given, the sample is chosen deterministically by ranking claims on
+                  a hash of their UUID and the seed, in the database, and the seed is stored with the batch.
+                - 'strata': Optional list of stratum keys (health_facility, visit_type, care_type, amount_band).
+                  When given, the sample is allocated across strata, see `_create_stratified_sample`.
+                - 'allocation': 'proportional' (default) or 'neyman', used together with 'strata'.
+                - 'monetary_unit': Optional (bool). When set, claims are drawn with probability proportional to
+                  the claimed amount, see `_create_monetary_unit_sample`.
             task_group (TaskGroup): Task Group to which newly created task will be assigned.
         Usage:
             >>> claim_data = {'percentage': 20, 'uuids': Claim.objects.all()}
@@ -67,103 +392,1290 @@ class ClaimSamplingService(BaseService):
             >>> service.create(claim_data)
 
         """
+        _validate_sampling_options(obj_data)
         percentage = int(obj_data.pop('percentage'))
         claim_batch_ids = obj_data.pop('uuids')  # UUIDS QuerySet
 
-        if len(claim_batch_ids) == 0:
+        claim_batch_ids = self.__validate_claims_to_sample(claim_batch_ids, percentage)
+        sampling_batch_data, sampling_batch = self._create_sampling_batch()
+
+        self._populate_sampling_batch(sampling_batch, claim_batch_ids, percentage, obj_data)
+        task = self._create_sampling_task(sampling_batch_data, sampling_batch, task_group)
+        self._init_statistics(sampling_batch)
+        self._update_progress(sampling_batch, status=SAMPLING_PROGRESS_COMPLETED)
+        return sampling_batch
+
+    @register_service_signal('claim_sampling_service.create_streaming')
+    def create_streaming(self, obj_data, task_group: TaskGroup = None):
+        """
+        Streaming variant of `create` for very large claim sets.
+
+        Filtered claims are walked in id order with a server-side cursor, `chunk_size` claims at a time. Review/skip
+        is decided per chunk so that the running number of claims selected for review always matches the requested
+        percentage of the claims seen so far, and each chunk is written and committed in its own transaction.
+        Neither the claim list nor the assignments are ever held in memory as a whole. When creation fails after
+        some chunks were committed, the assignments of the batch are released and the batch is marked FAILED, see
+        `_release_sampling_batch`.
+
+        Parameters:
+            obj_data (dict): Same as for `create`, optionally with:
+                - 'chunk_size': Number of claims processed per chunk (int), defaults to `sampling_chunk_size`.
+            task_group (TaskGroup): Task Group to which newly created task will be assigned.
+        """
+        _validate_sampling_options(obj_data)
+        percentage = int(obj_data.pop('percentage'))
+        claim_batch_ids = obj_data.pop('uuids')  # UUIDS QuerySet
+        chunk_size = int(obj_data.pop('chunk_size', None) or ClaimSamplingConfig.sampling_chunk_size)
+
+        claim_batch_ids = self.__validate_claims_to_sample(claim_batch_ids, percentage)
+        sampling_batch_data, sampling_batch = self._create_sampling_batch()
+
+        try:
+            self._populate_sampling_batch_streaming(sampling_batch, claim_batch_ids, percentage, chunk_size)
+            self._create_sampling_task(sampling_batch_data, sampling_batch, task_group)
+            self._init_statistics(sampling_batch)
+        except Exception as exc:
+            self._release_sampling_batch(sampling_batch, exc)
+            raise
+        self._update_progress(sampling_batch, status=SAMPLING_PROGRESS_COMPLETED)
+        return sampling_batch
+
+    @register_service_signal('claim_sampling_service.create_async')
+    def create_async(self, obj_data, task_group: TaskGroup = None):
+        """
+        Background variant of `create`. The claims are validated and the sampling batch is created right away, while
+        the claims are assigned to it by a background job started once the current transaction commits. Progress of
+        the job (claims scanned, assigned and selected for review) is kept in computed_value['progress'] of the batch
+        and can be polled with `get_progress`.
+
+        Parameters:
+            obj_data (dict): Same as for `create`, optionally with:
+                - 'streaming': Assign the claims chunk by chunk, as `create_streaming` does (bool).
+            task_group (TaskGroup): Task Group to which newly created task will be assigned.
+        """
+        _validate_sampling_options(obj_data)
+        percentage = int(obj_data.pop('percentage'))
+        claim_batch_ids = obj_data.pop('uuids')  # UUIDS QuerySet
+        streaming = obj_data.pop('streaming', False)
+
+        claim_batch_ids = self.__validate_claims_to_sample(claim_batch_ids, percentage)
+        sampling_batch_data, sampling_batch = self._create_sampling_batch({
+            'progress': {'status': SAMPLING_PROGRESS_QUEUED}
+        })
+
+        transaction.on_commit(lambda: submit_background_job(
+            self._run_creation_job, sampling_batch_data, sampling_batch, claim_batch_ids, percentage, obj_data,
+            streaming, task_group
+        ))
+        return sampling_batch
+
+    def _run_creation_job(self, sampling_batch_data, sampling_batch, claim_batch_ids, percentage, options,
+                          streaming, task_group):
+        try:
+            self._update_progress(sampling_batch, status=SAMPLING_PROGRESS_RUNNING)
+            if streaming and not _uses_dedicated_sampling(options):
+                self._populate_sampling_batch_streaming(
+                    sampling_batch, claim_batch_ids, percentage, ClaimSamplingConfig.sampling_chunk_size)
+            else:
+                with transaction.atomic():
+                    self._populate_sampling_batch(sampling_batch, claim_batch_ids, percentage, options)
+            self._create_sampling_task(sampling_batch_data, sampling_batch, task_group)
+            self._init_statistics(sampling_batch)
+            self._update_progress(sampling_batch, status=SAMPLING_PROGRESS_COMPLETED)
+        except Exception as exc:
+            logger.error("Error while creating claim sampling batch %s", sampling_batch.id, exc_info=exc)
+            # Streamed chunks, or the whole sample when the task creation failed, are already committed
+            self._release_sampling_batch(sampling_batch, exc)
+
+    def get_progress(self, claim_sampling_id):
+        computed_value = ClaimSamplingBatch.objects.filter(id=claim_sampling_id)\
+            .values_list('computed_value', flat=True).first() or {}
+        return computed_value.get('progress', {})
+
+    def _populate_sampling_batch(self, sampling_batch, claim_batch_ids, percentage, options):
+        seed = options.get('seed')
+        strata = options.get('strata')
+        allocation = options.get('allocation') or STRATIFIED_ALLOCATION_PROPORTIONAL
+
+        if options.get('monetary_unit'):
+            self._create_monetary_unit_sample(sampling_batch, claim_batch_ids, percentage, seed)
+        elif strata:
+            self._create_stratified_sample(sampling_batch, claim_batch_ids, percentage, strata, allocation, seed)
+        elif seed is not None:
+            self._create_seeded_sample(sampling_batch, claim_batch_ids, percentage, str(seed))
+        else:
+            claim_ids = list(claim_batch_ids.values_list('id', flat=True))
+            is_selected_for_review = self.__choose_random_claims_for_review(len(claim_ids), percentage)
+
+            self._create_assignments(sampling_batch, claim_ids, is_selected_for_review)
+        self._mark_claims_selected_for_review(sampling_batch)
+
+        assignments = ClaimSamplingBatchAssignment.objects.filter(claim_batch=sampling_batch).aggregate(
+            assigned=Count('id'),
+            selected=Count('id', filter=Q(status=ClaimSamplingBatchAssignmentStatus.IDLE))
+        )
+        self._update_progress(sampling_batch, scanned=assignments['assigned'], **assignments)
+
+    def _populate_sampling_batch_streaming(self, sampling_batch, claim_batch_ids, percentage, chunk_size):
+        claim_ids = claim_batch_ids.values_list('id', flat=True).order_by('id').iterator(chunk_size=chunk_size)
+        assigned, selected = 0, 0
+        for chunk in _chunked(claim_ids, chunk_size):
+            assigned += len(chunk)
+            to_select = max(1, int((percentage / 100.0) * assigned)) - selected
+            selected += to_select
+            with transaction.atomic():
+                self._create_assignments(sampling_batch, chunk, self.__shuffled_statuses(len(chunk), to_select))
+                self._mark_claims_selected_for_review(sampling_batch, id__range=(chunk[0], chunk[-1]))
+                self._update_progress(sampling_batch, scanned=assigned, assigned=assigned, selected=selected)
+
+    def _release_sampling_batch(self, sampling_batch, error):
+        """
+        Cleans up after a batch creation that failed with chunks already committed: the assignments of the batch are
+        soft deleted and its claims selected for review are set back to REVIEW_IDLE, so that the claims can be
+        sampled again, then the batch is marked FAILED.
+        """
+        with transaction.atomic():
+            Claim.objects.filter(
+                assignments__claim_batch=sampling_batch,
+                assignments__status=ClaimSamplingBatchAssignmentStatus.IDLE,
+                assignments__is_deleted=False,
+                review_status=Claim.REVIEW_SELECTED,
+                validity_to__isnull=True
+            ).update(review_status=Claim.REVIEW_IDLE)
+            ClaimSamplingBatchAssignment.objects.filter(claim_batch=sampling_batch, is_deleted=False)\
+                .update(is_deleted=True)
+            self._update_progress(sampling_batch, status=SAMPLING_PROGRESS_FAILED, error=str(error))
+
+    def _update_progress(self, sampling_batch, **progress):
+        _merge_computed_value(sampling_batch.id, 'progress', progress)
+
+    def _init_statistics(self, sampling_batch):
+        selected = Claim.objects.filter(
+            assignments__claim_batch=sampling_batch, assignments__status=ClaimSamplingBatchAssignmentStatus.IDLE
+        ).aggregate(selected=Count('id'), claimed=Coalesce(Sum('claimed'), 0, output_field=DecimalField()))
+        _merge_computed_value(sampling_batch.id, 'statistics', {
+            'selected': selected['selected'],
+            'claimed': float(selected['claimed']),
+            **{counter: 0 for counter in STATISTICS_COUNTERS}
+        })
+
+    def update_statistics(self, claim_uuids):
+        """
+        Brings the running review statistics (computed_value['statistics']) of the batches the given claims are
+        selected for up to date with the current state of the claims. Called after claim review and processing
+        mutations, claim submissions and the processing of claims by the extrapolation.
+
+        The contribution of every claim to the counters is kept in the json_ext of its assignment and only the
+        difference with the previous contribution is added to the counters, so calling this several times for the
+        same claims, or after a review is changed, doesn't count anything twice. Batch rows are locked before the
+        previous contributions are read, so concurrent updates of the same batch are serialized.
+        """
+        assignments = ClaimSamplingBatchAssignment.objects.filter(
+            claim__uuid__in=claim_uuids, is_deleted=False, status=ClaimSamplingBatchAssignmentStatus.IDLE
+        )
+        batch_ids = list(assignments.values_list('claim_batch_id', flat=True).distinct().order_by('claim_batch_id'))
+        if not batch_ids:
+            return
+
+        with transaction.atomic():
+            computed_values = dict(
+                ClaimSamplingBatch.objects.select_for_update().filter(id__in=batch_ids).order_by('id')
+                .values_list('id', 'computed_value')
+            )
+            totals = _review_totals_annotations()
+            contributions = {
+                claim['id']: self._review_contribution(claim)
+                for claim in Claim.objects.filter(id__in=assignments.values('claim_id'))
+                .annotate(**totals).values('id', 'status', 'review_status', 'approved', *totals)
+            }
+            updated_assignments = []
+            for assignment in assignments.only('id', 'claim_id', 'claim_batch_id', 'json_ext'):
+                json_ext = assignment.json_ext or {}
+                previous = json_ext.get('statistics', {})
+                current = contributions[assignment.claim_id]
+                computed_value = computed_values[assignment.claim_batch_id] = \
+                    computed_values[assignment.claim_batch_id] or {}
+                statistics = computed_value.setdefault('statistics', {})
+                for counter in STATISTICS_COUNTERS:
+                    statistics[counter] = statistics.get(counter, 0) + current[counter] - previous.get(counter, 0)
+                assignment.json_ext = {**json_ext, 'statistics': current}
+                updated_assignments.append(assignment)
+
+            ClaimSamplingBatchAssignment.objects.bulk_update(updated_assignments, ['json_ext'])
+            for claim_sampling_id, computed_value in computed_values.items():
+                ClaimSamplingBatch.objects.filter(id=claim_sampling_id).update(computed_value=computed_value)
+        invalidate_sampling_summaries(batch_ids)
+
+    def _review_contribution(self, claim):
+        delivered = claim['review_status'] == Claim.REVIEW_DELIVERED
+        return {
+            'reviewed': int(claim['review_status'] != Claim.REVIEW_SELECTED),
+            'delivered': int(delivered),
+            'rejected': int(delivered and claim['status'] == Claim.STATUS_REJECTED),
+            'approved': float(claim['approved'] or 0) if delivered else 0.0,
+            'items_approved': float(claim['itm_approved'] or 0) if delivered else 0.0,
+            'services_approved': float(claim['srv_approved'] or 0) if delivered else 0.0,
+            'items_adjusted': float(claim['itm_adjusted'] or 0) if delivered else 0.0,
+            'services_adjusted': float(claim['srv_adjusted'] or 0) if delivered else 0.0,
+        }
+
+    def preview(self, obj_data):
+        """
+        Dry run of `create`: reports what a sampling batch created from the same data would contain, without
+        creating anything. Only aggregates are queried, no claim is loaded in memory.
+
+        Amounts in review are expected values, actual amounts depend on which claims get drawn. For monetary-unit
+        sampling a claim is in review with probability min(1, claimed / sampling interval).
+
+        Parameters:
+            obj_data (dict): Same as for `create` ('percentage', 'uuids', 'strata', 'allocation', 'monetary_unit').
+        Returns:
+            dict: 'matched', 'already_assigned', 'to_assign', 'sample_size', 'claimed_in_review',
+            'claimed_skipped' and, for stratified sampling, 'strata' with the allocation of every stratum.
+        """
+        percentage = int(obj_data['percentage'])
+        if percentage < 1 or percentage > 100:
+            raise ValueError(_("Percentage not in range (0, 100)"))
+        _validate_sampling_options(obj_data)
+        strata = obj_data.get('strata')
+        allocation = obj_data.get('allocation') or STRATIFIED_ALLOCATION_PROPORTIONAL
+
+        claims = Claim.objects.filter(id__in=obj_data['uuids'].values('id'))
+        not_assigned = ~Exists(ClaimSamplingBatchAssignment.objects.filter(claim=OuterRef('pk'), is_deleted=False))
+        totals = claims.aggregate(
+            matched=Count('id'),
+            to_assign=Count('id', filter=not_assigned),
+            claimed=Sum('claimed', filter=not_assigned),
+        )
+        to_assign, claimed = totals['to_assign'], float(totals['claimed'] or 0)
+        preview = {
+            'matched': totals['matched'],
+            'already_assigned': totals['matched'] - to_assign,
+            'to_assign': to_assign,
+            'sample_size': 0,
+            'claimed_in_review': 0.0,
+            'claimed_skipped': claimed,
+            'strata': None,
+        }
+        if not to_assign:
+            return preview
+
+        candidates = claims.filter(not_assigned)
+        sample_size = self.__sample_size(to_assign, percentage)
+        if obj_data.get('monetary_unit'):
+            claimed_in_review = self._preview_monetary_unit_review(candidates, claimed, sample_size)
+        elif strata:
+            strata_stats = self._strata_statistics(candidates.annotate(**_stratum_expressions(strata)), strata)
+            allocations = allocate_stratified_sample(strata_stats, sample_size, allocation)
+            preview['strata'] = [{
+                'key': {key: stratum[_stratum_column(key)] for key in strata},
+                'population': stratum['population'],
+                'sample': stratum_sample,
+                'claimed': float(stratum['claimed'] or 0),
+                'claimed_in_review': float(stratum['claimed'] or 0) * stratum_sample / stratum['population'],
+            } for stratum, stratum_sample in zip(strata_stats, allocations)]
+            sample_size = sum(allocations)
+            claimed_in_review = sum(stratum['claimed_in_review'] for stratum in preview['strata'])
+        else:
+            claimed_in_review = claimed * sample_size / to_assign
+
+        preview.update(
+            sample_size=sample_size,
+            claimed_in_review=claimed_in_review,
+            claimed_skipped=claimed - claimed_in_review
+        )
+        return preview
+
+    def _preview_monetary_unit_review(self, claims, total_claimed, sample_size):
+        if total_claimed <= 0:
+            raise ValueError(_("Claimed amount of the claims is 0"))
+        interval = total_claimed / sample_size
+        return float(claims.aggregate(claimed_in_review=Sum(Least(
+            ExpressionWrapper(F('claimed'), output_field=FloatField()),
+            ExpressionWrapper(F('claimed') * F('claimed') / Value(interval), output_field=FloatField())
+        )))['claimed_in_review'] or 0)
+
+    @register_service_signal('claim_sampling_service.update')
+    def update(self, obj_data):
+        return super().update(obj_data)
+
+    @register_service_signal('claim_sampling_service.delete')
+    def delete(self, obj_data):
+        return super().delete(obj_data)
+
+    def __validate_claims_to_sample(self, claim_batch_ids, percentage):
+        if not claim_batch_ids.exists():
             raise ValueError(_("Claim List cannot be empty"))
 
         claim_batch_ids = self.__filter_already_assigned(claim_batch_ids=claim_batch_ids)
 
-        if len(claim_batch_ids) == 0:
+        if not claim_batch_ids.exists():
             raise ValueError(_("All claims already assigned"))
 
         if percentage < 1 or percentage > 100:
             raise ValueError(_("Percentage not in range (0, 100)"))
 
+        return claim_batch_ids
+
+    def _create_sampling_batch(self, computed_value=None):
         sampling_batch_data = super().create({
             'is_completed': False,
             'is_applied': False,
-            'computed_value': {},
+            'computed_value': computed_value or {},
             'assigned_value': {}
         })
         sampling_batch = ClaimSamplingBatch.objects.get(uuid=sampling_batch_data['data']['uuid'])
+        return sampling_batch_data, sampling_batch
 
-        is_selected_for_review = self.__choose_random_claims_for_review(claim_batch_ids.count(), percentage)
-
-        batches = []
-        for next_claim in claim_batch_ids:
-            claim = Claim.objects.get(uuid=next_claim)
-            should_be_reviewed = is_selected_for_review.pop()
-            batches.append(ClaimSamplingBatchAssignment(
-             uuid=uuid.uuid4(),
-             claim=claim,
-             claim_batch=sampling_batch,
-             status=should_be_reviewed,
-             user_created=self.user,
-             user_updated=self.user
-            ))
-            if claim.review_status in [Claim.REVIEW_IDLE, Claim.REVIEW_NOT_SELECTED] \
-                    and should_be_reviewed == ClaimSamplingBatchAssignmentStatus.IDLE:
-                claim.review_status = Claim.REVIEW_SELECTED
-                claim.save_history()
-                claim.save()
-
-        ClaimSamplingBatchAssignment.objects.bulk_create(batches)
-        task = self._create_sampling_task(sampling_batch_data, sampling_batch, task_group)
-        return sampling_batch
+    def _create_assignments(self, sampling_batch, claim_ids, statuses):
+        """
+        Bulk inserts assignments. A claim can only have one active assignment (enforced by a partial unique index),
+        so claims assigned concurrently by another batch are skipped instead of failing the whole insert where the
+        database supports it.
+        """
+        ClaimSamplingBatchAssignment.objects.bulk_create(
+            self._build_assignments(sampling_batch, claim_ids, statuses),
+            ignore_conflicts=connection.features.supports_ignore_conflicts
+        )
 
-    @register_service_signal('claim_sampling_service.update')
-    def update(self, obj_data):
-        return super().update(obj_data)
+    def _build_assignments(self, sampling_batch, claim_ids, statuses):
+        return [
+            ClaimSamplingBatchAssignment(
+                uuid=uuid.uuid4(),
+                claim_id=claim_id,
+                claim_batch=sampling_batch,
+                status=status,
+                user_created=self.user,
+                user_updated=self.user
+            ) for claim_id, status in zip(claim_ids, statuses)
+        ]
 
-    @register_service_signal('claim_sampling_service.delete')
-    def delete(self, obj_data):
-        return super().delete(obj_data)
+    def _create_seeded_sample(self, sampling_batch, claim_batch_ids, percentage, seed):
+        """
+        Selects the claims to review without leaving the database: claims are ranked on md5(uuid + seed) and the
+        `sample_size` lowest hashes are reviewed. The hash of the last selected claim is used as a threshold so that
+        the status of every assignment is a plain CASE expression, and assignments are written with a single
+        INSERT ... SELECT.
+        """
+        claims = Claim.objects.filter(id__in=claim_batch_ids.values('id'))
+        sample_size = self.__sample_size(claims.count(), percentage)
+        threshold = claims.annotate(sample_hash=_sample_hash_expression(seed))\
+            .order_by('sample_hash').values_list('sample_hash', flat=True)[sample_size - 1]
+
+        _merge_computed_value(sampling_batch.id, 'sampling', {
+            'method': 'seeded', 'seed': seed, 'percentage': percentage, 'sample_size': sample_size
+        })
+        sampled_claims = claims.annotate(sample_hash=_sample_hash_expression(seed)).annotate(sample_status=Case(
+            When(sample_hash__lte=threshold, then=Value(ClaimSamplingBatchAssignmentStatus.IDLE)),
+            default=Value(ClaimSamplingBatchAssignmentStatus.SKIPPED),
+            output_field=CharField()
+        )).values_list('id', 'sample_status').order_by()
+        self._insert_assignments_from_select(sampling_batch, sampled_claims)
+
+    def _create_stratified_sample(self, sampling_batch, claim_batch_ids, percentage, strata, allocation, seed=None):
+        """
+        Splits the claims into strata and allocates the sample across them, so that every stratum is represented.
+        Stratum sizes (and standard deviations of the claimed amount for Neyman allocation) come from one grouped
+        query. Claims are then streamed once in id order and, inside each stratum, claims at randomly drawn
+        positions are selected for review, drawn from `seed` when given so that the sample can be reproduced.
+        Per-stratum allocations are recorded in the batch computed_value.
+        """
+        claims = Claim.objects.filter(id__in=claim_batch_ids.values('id')) \
+            .annotate(**_stratum_expressions(strata))
+        stratum_columns = [_stratum_column(key) for key in strata]
+        strata_stats = self._strata_statistics(claims, strata)
+        sample_size = self.__sample_size(sum(stratum['population'] for stratum in strata_stats), percentage)
+        allocations = allocate_stratified_sample(strata_stats, sample_size, allocation)
+
+        _merge_computed_value(sampling_batch.id, 'sampling', {
+            'method': 'stratified',
+            'seed': seed,
+            'percentage': percentage,
+            'allocation': allocation,
+            'strata_keys': strata,
+            'sample_size': sum(allocations),
+            'strata': [{
+                'key': {key: stratum[_stratum_column(key)] for key in strata},
+                'population': stratum['population'],
+                'sample': stratum_sample,
+                'claimed': float(stratum['claimed'] or 0),
+                'stddev': float(stratum['stddev'] or 0),
+            } for stratum, stratum_sample in zip(strata_stats, allocations)]
+        })
+
+        draw = random.Random(seed)
+        selected_positions = {
+            tuple(stratum[column] for column in stratum_columns): set(draw.sample(range(stratum['population']),
+                                                                                 stratum_sample))
+            for stratum, stratum_sample in zip(strata_stats, allocations)
+        }
+        positions = defaultdict(int)
+        scanned, selected = 0, 0
+        claim_rows = claims.values_list('id', *stratum_columns).order_by('id')\
+            .iterator(chunk_size=ClaimSamplingConfig.sampling_chunk_size)
+        for chunk in _chunked(claim_rows, ClaimSamplingConfig.sampling_chunk_size):
+            statuses = []
+            for claim_id, *stratum_key in chunk:
+                stratum_key = tuple(stratum_key)
+                is_selected = positions[stratum_key] in selected_positions.get(stratum_key, ())
+                positions[stratum_key] += 1
+                statuses.append(ClaimSamplingBatchAssignmentStatus.IDLE if is_selected
+                                else ClaimSamplingBatchAssignmentStatus.SKIPPED)
+            self._create_assignments(sampling_batch, [row[0] for row in chunk], statuses)
+            scanned += len(chunk)
+            selected += statuses.count(ClaimSamplingBatchAssignmentStatus.IDLE)
+            self._update_progress(sampling_batch, scanned=scanned, assigned=scanned, selected=selected)
+
+    def _strata_statistics(self, claims, strata):
+        """
+        Population, claimed amount and its standard deviation of every stratum, from one grouped query over claims
+        annotated with `_stratum_expressions`.
+        """
+        stratum_columns = [_stratum_column(key) for key in strata]
+        return list(
+            claims.values(*stratum_columns)
+            .annotate(population=Count('id'), claimed=Sum('claimed'), stddev=StdDev('claimed'))
+            .order_by(*stratum_columns)
+        )
+
+    def _create_monetary_unit_sample(self, sampling_batch, claim_batch_ids, percentage, seed=None):
+        """
+        Monetary-unit (probability proportional to size) sampling. The claimed amounts are laid end to end and
+        `sample_size` monetary units are drawn systematically, every `total claimed / sample_size` from a random
+        start; a claim is reviewed when it contains at least one drawn unit. The running total is computed by the
+        database with a window function and the claims are streamed once in id order. Claims larger than the
+        sampling interval are always reviewed.
+        """
+        claims = Claim.objects.filter(id__in=claim_batch_ids.values('id'))
+        totals = claims.aggregate(count=Count('id'), claimed=Sum('claimed'))
+        total_claimed = float(totals['claimed'] or 0)
+        if total_claimed <= 0:
+            raise ValueError(_("Claimed amount of the claims is 0"))
+
+        sample_size = self.__sample_size(totals['count'], percentage)
+        interval = total_claimed / sample_size
+        start = random.Random(seed).uniform(0, interval)
+
+        _merge_computed_value(sampling_batch.id, 'sampling', {
+            'method': 'monetary_unit',
+            'percentage': percentage,
+            'sample_size': sample_size,
+            'total_claimed': total_claimed,
+            'interval': interval,
+            'start': start,
+        })
+
+        claim_rows = claims.annotate(cumulative_claimed=Window(
+            expression=Sum(Coalesce('claimed', Value(0), output_field=DecimalField())),
+            order_by=F('id').asc()
+        )).values_list('id', 'cumulative_claimed').order_by('id')\
+            .iterator(chunk_size=ClaimSamplingConfig.sampling_chunk_size)
+
+        next_unit = start
+        scanned, selected = 0, 0
+        for chunk in _chunked(claim_rows, ClaimSamplingConfig.sampling_chunk_size):
+            statuses = []
+            for _claim_id, cumulative_claimed in chunk:
+                cumulative_claimed = float(cumulative_claimed or 0)
+                if next_unit < cumulative_claimed:
+                    statuses.append(ClaimSamplingBatchAssignmentStatus.IDLE)
+                    while next_unit < cumulative_claimed:
+                        next_unit += interval
+                else:
+                    statuses.append(ClaimSamplingBatchAssignmentStatus.SKIPPED)
+            self._create_assignments(sampling_batch, [row[0] for row in chunk], statuses)
+            scanned += len(chunk)
+            selected += statuses.count(ClaimSamplingBatchAssignmentStatus.IDLE)
+            self._update_progress(sampling_batch, scanned=scanned, assigned=scanned, selected=selected)
+
+    def _insert_assignments_from_select(self, sampling_batch, sampled_claims):
+        """
+        Inserts one assignment per (claim_id, status) row of `sampled_claims` with a single INSERT ... SELECT.
+        Databases without a SQL UUID generator fall back to streaming the rows through bulk_create.
+        """
+        new_uuid_sql = _NEW_UUID_SQL.get(connection.vendor)
+        if new_uuid_sql is None:
+            for chunk in _chunked(sampled_claims.iterator(), ClaimSamplingConfig.sampling_chunk_size):
+                claim_ids, statuses = zip(*chunk)
+                self._create_assignments(sampling_batch, claim_ids, statuses)
+            return
+
+        now = datetime.datetime.now()
+        values = {
+            'is_deleted': False,
+            'date_created': now,
+            'date_updated': now,
+            'version': 1,
+            'claim_batch': sampling_batch.id,
+            'user_created': self.user.id,
+            'user_updated': self.user.id,
+        }
+        meta = ClaimSamplingBatchAssignment._meta
+        quote_name = connection.ops.quote_name
+        columns = [meta.pk.column] + [meta.get_field(field).column for field in values] + \
+                  [meta.get_field('claim').column, meta.get_field('status').column]
+        params = [meta.get_field(field).get_db_prep_value(value, connection) for field, value in values.items()]
+        select_sql, select_params = sampled_claims.query.sql_with_params()
+
+        # Claims assigned concurrently by another batch violate the unique index on active assignments
+        on_conflict_sql = " ON CONFLICT DO NOTHING" if connection.vendor == 'postgresql' else ""
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {quote_name(meta.db_table)} ({', '.join(quote_name(column) for column in columns)}) "
+                f"SELECT {new_uuid_sql}, {', '.join(['%s'] * len(params))}, sampled.* FROM ({select_sql}) sampled"
+                f"{on_conflict_sql}",
+                params + list(select_params)
+            )
+
+    def derive_seeded_sample(self, claim_sampling_id):
+        """
+        Re-derives the claims selected for review in a seeded batch from its stored seed, for audit purposes.
+        The result should always match the IDLE assignments of the batch.
+        """
+        sampling = ClaimSamplingBatch.objects.filter(id=claim_sampling_id)\
+            .values_list('computed_value', flat=True).first() or {}
+        sampling = sampling.get('sampling', {})
+        if sampling.get('method') != 'seeded':
+            raise ValueError(_("Claim sampling batch was not created with a seed"))
+
+        return Claim.objects.filter(id__in=Claim.objects
+                                    .filter(assignments__claim_batch_id=claim_sampling_id)
+                                    .annotate(sample_hash=_sample_hash_expression(sampling['seed']))
+                                    .order_by('sample_hash')
+                                    .values('id')[:sampling['sample_size']])
+
+    def _mark_claims_selected_for_review(self, sampling_batch, **claim_filters):
+        """
+        Sets review_status of the claims sampled for review to REVIEW_SELECTED. History copies of the claims
+        and of their items and services are bulk inserted first, the same way Claim.save_history() does it
+        one claim at a time, so the number of queries doesn't depend on the size of the batch.
+        """
+        selected_claims = Claim.objects.filter(
+            assignments__claim_batch=sampling_batch,
+            assignments__status=ClaimSamplingBatchAssignmentStatus.IDLE,
+            review_status__in=[Claim.REVIEW_IDLE, Claim.REVIEW_NOT_SELECTED],
+            validity_to__isnull=True
+        ).filter(**claim_filters)
+        self._save_claims_history(selected_claims)
+        selected_claims.update(review_status=Claim.REVIEW_SELECTED)
+
+    def _save_claims_history(self, claims):
+        now = datetime.datetime.now()
+        history = [_history_copy(claim, now) for claim in claims]
+        if not history:
+            return
+
+        Claim.objects.bulk_create(history)
+        history_uuids = {str(histo.uuid).lower() for histo in history}
+        history_ids = {
+            legacy_id: history_id for claim_uuid, legacy_id, history_id in Claim.objects
+            .filter(legacy_id__in=claims.values('id'), validity_to__isnull=False)
+            .values_list('uuid', 'legacy_id', 'id')
+            if str(claim_uuid).lower() in history_uuids
+        }
+        for detail_model in (ClaimItem, ClaimService):
+            details = detail_model.objects.filter(claim__in=claims, validity_to__isnull=True)
+            detail_model.objects.bulk_create([
+                _history_copy(detail, now, claim_id=history_ids[detail.claim_id]) for detail in details
+            ])
 
     def __filter_already_assigned(self, claim_batch_ids):
-        filtered_claim_batch_ids = claim_batch_ids.exclude(id__in=ClaimSamplingBatchAssignment.objects.filter(claim__uuid__in=claim_batch_ids).values("claim"))
-        return filtered_claim_batch_ids
+        # Correlated NOT EXISTS answered from the unique index on active assignments of a claim
+        return claim_batch_ids.exclude(Exists(
+            ClaimSamplingBatchAssignment.objects.filter(claim=OuterRef('pk'), is_deleted=False)
+        ))
 
-    @transaction.atomic
     def extrapolate_results(self, claim_sampling_id):
-        claim_sampling = ClaimSamplingBatch.objects.get(id=claim_sampling_id)
+        """
+        Applies the deductible ratio of the reviewed claims of the batch to the claims skipped from review, then
+        processes the batch claims left CHECKED.
+
+        Extrapolation is checkpointed in computed_value['extrapolation'] of the batch: prices are extrapolated in
+        one transaction together with the checkpoint ('phase' PROCESSING, the 'deductible' used and the claim id
+        'ranges' to process), then every processed chunk records the last claim id it reached ('watermark' of its
+        range) in its own transaction, see `_process_checked_claims`. When a run is interrupted, calling this again
+        continues from the last committed chunk without extrapolating prices a second time. Errors of chunks
+        committed by the interrupted run are not returned again.
+
+        Returns:
+            list: Errors raised by the processing of the claims.
+        """
+        claim_sampling = get_sampling_batch(claim_sampling_id)
 
         qs = Claim.objects.filter(assignments__claim_batch=claim_sampling, *filter_validity())
-        
-        deductible = qs.filter(review_status=Claim.REVIEW_DELIVERED)\
-            .filter(Q(services__rejection_reason__lte=0) | Q(services__rejection_reason__isnull=True))\
-            .annotate(total_srv_adjusted=total_srv_adjusted_exp)\
-            .annotate(total_itm_adjusted=total_itm_adjusted_exp)\
-            .annotate(total_srv_approved=total_srv_approved_exp)\
-            .annotate(total_itm_approved=total_itm_approved_exp)\
-            .aggregate(value=ExpressionWrapper(
-                (Sum("total_srv_approved") + Sum("total_itm_approved")) /
-                ( Sum("total_srv_adjusted") + Sum("total_itm_adjusted")),
-                output_field=DecimalField()
-            ))["value"]
+
+        checkpoint = (claim_sampling.computed_value or {}).get('extrapolation', {})
+        if checkpoint.get('phase') == EXTRAPOLATION_COMPLETED:
+            return []
+        if checkpoint.get('phase') != EXTRAPOLATION_PROCESSING:
+            checkpoint = self._extrapolate_prices(claim_sampling, qs)
+
+        id_ranges = checkpoint['ranges']
+        if len(id_ranges) > 1 and not connection.in_atomic_block:
+            results = map_in_processes(
+                _process_claims_worker,
+                [(self.user.id, claim_sampling.id, index, id_range) for index, id_range in enumerate(id_ranges)],
+                len(id_ranges)
+            )
+        else:
+            # Worker processes can't see uncommitted data of an enclosing transaction, ranges are processed serially
+            results = [self._process_checked_claims(claim_sampling.id, qs, index, id_range)
+                       for index, id_range in enumerate(id_ranges)]
+
+        _merge_computed_value(claim_sampling.id, 'extrapolation', {'phase': EXTRAPOLATION_COMPLETED})
+        invalidate_sampling_summaries([claim_sampling.id])
+        return [error for range_errors in results for error in range_errors]
+
+    def extrapolate_task(self, task_id):
+        """
+        Extrapolates the results of the batch of an extrapolation task, then completes the task, as failed when the
+        extrapolation raised. The status of the extrapolation (RUNNING, COMPLETED or FAILED, with the 'error' or the
+        number of claims that failed processing) is kept in json_ext['extrapolation'] of the task.
+        """
+        task = Task.objects.get(id=task_id)
+        self._update_task_extrapolation(task_id, status=TASK_EXTRAPOLATION_RUNNING)
+        try:
+            errors = self.extrapolate_results(task.data['data']['uuid'])
+        except Exception as exc:
+            logger.error("Error while extrapolating claim sampling task %s", task_id, exc_info=exc)
+            self._complete_task(task_id, failed=True)
+            self._update_task_extrapolation(task_id, status=TASK_EXTRAPOLATION_FAILED, error=str(exc))
+            return
+        # The task is saved from its cached instance when completed, the status is written afterwards to be kept
+        self._complete_task(task_id)
+        self._update_task_extrapolation(task_id, status=TASK_EXTRAPOLATION_COMPLETED, failed_claims=len(errors))
+
+    def _complete_task(self, task_id, failed=False):
+        result = TaskService(self.user).complete_task({'id': task_id, 'failed': failed})
+        if not result.get('success'):
+            logger.error("Could not complete claim sampling task %s: %s", task_id, result.get('detail'))
+
+    def extrapolate_task_async(self, task_id):
+        """
+        Background variant of `extrapolate_task`, started once the current transaction commits. The task is marked
+        QUEUED in the meantime.
+        """
+        self._update_task_extrapolation(task_id, status=TASK_EXTRAPOLATION_QUEUED)
+        transaction.on_commit(lambda: submit_background_job(self.extrapolate_task, task_id))
+
+    def _update_task_extrapolation(self, task_id, **extrapolation):
+        # Updated directly, bookkeeping writes don't create new versions of the task
+        with transaction.atomic():
+            json_ext = Task.objects.select_for_update().filter(id=task_id)\
+                .values_list('json_ext', flat=True).first() or {}
+            json_ext['extrapolation'] = extrapolation
+            Task.objects.filter(id=task_id).update(json_ext=json_ext)
+
+    @transaction.atomic
+    def _extrapolate_prices(self, claim_sampling, qs):
+        deductible = self._statistics_deductible(claim_sampling) or self.compute_deductible(claim_sampling)
+        strata = self._extrapolation_strata(claim_sampling)
+        stratum_deductibles = self._stratum_deductibles(claim_sampling, strata) if strata else []
+        _merge_computed_value(claim_sampling.id, 'deductible', {**deductible, 'strata': stratum_deductibles})
+        _merge_computed_value(claim_sampling.id, 'estimate', self.estimate_deductible(claim_sampling) or {})
+        deductible = deductible['value']
 
         # Filter claims for extrapolation
         qs_extrapolated = qs.filter(
-            assignments__status=ClaimSamplingBatchAssignmentStatus.SKIPPED, 
+            assignments__status=ClaimSamplingBatchAssignmentStatus.SKIPPED,
             review_status=Claim.REVIEW_IDLE
         )
-        
+
+        # Claims processed afterwards, their status and processed amounts are snapshotted as well
+        qs_processed = qs.filter(Q(id__in=qs_extrapolated.values('id')) | Q(status=Claim.STATUS_CHECKED))
+        self._snapshot_extrapolated_claims(claim_sampling, qs_extrapolated, qs_processed)
+
         # update the items and services
         deductible = float(deductible or 0)
-        
+        factor = self._deductible_factor(strata, stratum_deductibles, deductible)
+
+        # update service and item, the same rows as snapshotted
+        for detail_model in (ClaimItem, ClaimService):
+            self._extrapolated_details(detail_model, qs_extrapolated).update(
+                price_approved=ExpressionWrapper(factor * F("price_adjusted"), output_field=DecimalField()))
 
-        # update service and item
-        ClaimItem.objects.filter(claim__in=qs_extrapolated).update(price_approved=deductible * F("price_adjusted"))
-        ClaimService.objects.filter(claim__in=qs_extrapolated).update(price_approved=deductible * F("price_adjusted"))
+        _update_claims_approved(qs_extrapolated, review_status=Claim.REVIEW_BYPASSED)
+
+        # With process-pool mode, CHECKED claims are split into one disjoint claim id range per worker
+        workers = max(ClaimSamplingConfig.extrapolation_workers or 1, 1)
+        checkpoint = {
+            'phase': EXTRAPOLATION_PROCESSING,
+            'deductible': deductible,
+            'ranges': [
+                {'start': start, 'end': end, 'watermark': None}
+                for start, end in self._checked_claim_ranges(qs, workers)
+            ],
+        }
+        _merge_computed_value(claim_sampling.id, 'extrapolation', checkpoint)
+        return checkpoint
+
+    def _extrapolated_details(self, detail_model, claims):
+        return detail_model.objects.filter(*filter_validity(), claim__in=claims)
+
+    def _snapshot_extrapolated_claims(self, claim_sampling, claims, processed_claims):
+        """
+        Saves the approved prices of the valid items and services of the extrapolated `claims`, and the approved
+        amount and `CLAIM_SNAPSHOT_FIELDS` of these and of the `processed_claims`, with one INSERT ... SELECT per
+        table, before extrapolation overwrites them.
+        """
+        for kind, detail_model in ((ClaimSamplingSnapshotKind.ITEM, ClaimItem),
+                                   (ClaimSamplingSnapshotKind.SERVICE, ClaimService)):
+            self._insert_snapshot(
+                claim_sampling, kind, ['row_id', 'amount'],
+                self._extrapolated_details(detail_model, claims).values_list('id', 'price_approved').order_by()
+            )
+        self._insert_snapshot(
+            claim_sampling, ClaimSamplingSnapshotKind.CLAIM,
+            ['row_id', 'amount', *CLAIM_SNAPSHOT_FIELDS],
+            processed_claims.values_list('id', 'approved', *CLAIM_SNAPSHOT_FIELDS).order_by()
+        )
+
+    def _insert_snapshot(self, claim_sampling, kind, fields, rows):
+        meta = ClaimSamplingSnapshot._meta
+        quote_name = connection.ops.quote_name
+        columns = [meta.get_field(field).column for field in ['claim_batch', 'kind', *fields]]
+        select_sql, select_params = rows.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {quote_name(meta.db_table)} ({', '.join(quote_name(column) for column in columns)}) "
+                f"SELECT %s, %s, snapshot.* FROM ({select_sql}) snapshot",
+                [claim_sampling.id, kind, *select_params]
+            )
+
+    @transaction.atomic
+    def rollback_extrapolation(self, claim_sampling_id):
+        """
+        Restores the approved prices of items and services and the approved amount, review status, status, valuated
+        amount and processing stamps of claims overwritten by the extrapolation of the batch, from the snapshot taken by
+        `extrapolate_results`, with one UPDATE per table, so that claims processed by the extrapolation are CHECKED
+        again. Claims remunerated or included in a batch run since can't be reverted, the rollback is then refused.
+        The snapshot is deleted and the batch can be extrapolated again.
+        """
+        snapshots = ClaimSamplingSnapshot.objects.filter(claim_batch_id=claim_sampling_id)
+        if not snapshots.exists():
+            raise ValueError(_("Extrapolation of the batch can't be rolled back, it has no snapshot"))
+        snapshot_claims = Claim.objects.filter(
+            id__in=snapshots.filter(kind=ClaimSamplingSnapshotKind.CLAIM).values('row_id'))
+        if snapshot_claims.filter(Q(batch_run__isnull=False) | Q(remunerated__isnull=False)).exists():
+            raise ValueError(_("Extrapolation of the batch can't be rolled back, its claims were already remunerated"))
+
+        for kind, model, fields in (
+                (ClaimSamplingSnapshotKind.ITEM, ClaimItem, {'price_approved': 'amount'}),
+                (ClaimSamplingSnapshotKind.SERVICE, ClaimService, {'price_approved': 'amount'}),
+                (ClaimSamplingSnapshotKind.CLAIM, Claim, {'approved': 'amount',
+                                                          **{field: field for field in CLAIM_SNAPSHOT_FIELDS}})):
+            kind_snapshots = snapshots.filter(kind=kind)
+            model.objects.filter(id__in=kind_snapshots.values('row_id')).update(**{
+                field: Subquery(kind_snapshots.filter(row_id=OuterRef('pk')).values(snapshot_field)[:1])
+                for field, snapshot_field in fields.items()
+            })
+
+        self.update_statistics(snapshot_claims.values('uuid'))
+        snapshots.delete()
+        _merge_computed_value(claim_sampling_id, 'extrapolation', {'phase': EXTRAPOLATION_ROLLED_BACK})
+        invalidate_sampling_summaries([claim_sampling_id])
+
+    def _extrapolation_strata(self, claim_sampling):
+        sampling = (claim_sampling.computed_value or {}).get('sampling', {})
+        if sampling.get('method') == 'monetary_unit':
+            return []
+        return sampling.get('strata_keys') or ClaimSamplingConfig.extrapolation_strata or []
+
+    def _stratum_deductibles(self, claim_sampling, strata):
+        """
+        Deductible ratio of every stratum of the batch, from the approved and adjusted amounts of the items and
+        services of its reviewed claims, grouped by stratum in a single UNION ALL query.
+        """
+        reviewed = Claim.objects.filter(
+            *filter_validity(),
+            assignments__claim_batch=claim_sampling,
+            review_status=Claim.REVIEW_DELIVERED
+        )
+        rows = self._stratum_totals(ClaimItem, reviewed, strata)\
+            .union(self._stratum_totals(ClaimService, reviewed, strata), all=True)
+
+        totals = defaultdict(lambda: [0.0, 0.0])
+        for *stratum_key, approved, adjusted in rows:
+            stratum_totals = totals[tuple(stratum_key)]
+            stratum_totals[0] += float(approved or 0)
+            stratum_totals[1] += float(adjusted or 0)
+        return [{
+            'key': dict(zip(strata, stratum_key)),
+            'approved': approved,
+            'adjusted': adjusted,
+            'value': approved / adjusted if adjusted else None,
+        } for stratum_key, (approved, adjusted) in totals.items()]
+
+    def _stratum_totals(self, detail_model, claims, strata):
+        stratum_columns = [_stratum_column(key) for key in strata]
+        return detail_model.objects.filter(*filter_validity(), claim__in=claims)\
+            .annotate(**_stratum_expressions(strata, prefix='claim__'))\
+            .values(*stratum_columns)\
+            .annotate(approved=Sum(_detail_approved_exp()), adjusted=Sum(elm_adjusted_exp()))\
+            .values_list(*stratum_columns, 'approved', 'adjusted')\
+            .order_by()
+
+    def _deductible_factor(self, strata, stratum_deductibles, deductible):
+        """
+        Deductible applied to an item or service. With stratum deductibles it is a correlated subquery placing the
+        claim of the item or service in its stratum, strata without any reviewed amount fall back to `deductible`.
+        """
+        cases = [
+            When(Q(**{_stratum_column(key): value for key, value in stratum['key'].items()}),
+                 then=Value(stratum['value']))
+            for stratum in stratum_deductibles if stratum['value'] is not None
+        ]
+        if not cases:
+            return Value(deductible, output_field=DecimalField())
+        return Subquery(
+            Claim.objects.filter(pk=OuterRef('claim_id'))
+            .annotate(**_stratum_expressions(strata))
+            .annotate(deductible=Case(*cases, default=Value(deductible), output_field=DecimalField()))
+            .values('deductible')[:1],
+            output_field=DecimalField()
+        )
 
-        update_claim_approved(qs_extrapolated, updates={'review_status': Claim.REVIEW_BYPASSED})
+    def _checked_claim_ranges(self, claims, parts):
+        checked_ids = claims.filter(status=Claim.STATUS_CHECKED).order_by('id').values_list('id', flat=True)
+        total = checked_ids.count()
+        if not total:
+            return []
+        starts = sorted({checked_ids[total * part // parts] for part in range(parts)})
+        ends = [start - 1 for start in starts[1:]] + [checked_ids.last()]
+        return list(zip(starts, ends))
 
+    def _process_checked_claims(self, claim_sampling_id, claims, range_index, id_range, chunk_size=None):
+        """
+        Runs `processing_claim` on the CHECKED claims of `claims` in one range of the extrapolation checkpoint,
+        walking them in id order `chunk_size` claims at a time from the watermark of the range. Every chunk is
+        loaded with insurees, health facilities, items, services and their policies prefetched, and is committed
+        in its own transaction together with its watermark, so that a large batch doesn't hold its locks until the
+        last claim is processed.
+        """
+        chunk_size = chunk_size or ClaimSamplingConfig.extrapolation_chunk_size
+        checked_claims = claims.filter(status=Claim.STATUS_CHECKED, id__range=(id_range['start'], id_range['end']))\
+            .order_by('id')
         errors = []
-        for claim in qs.filter(status=Claim.STATUS_CHECKED):
-            errors += processing_claim(claim, self.user, True)
+        last_id = id_range['watermark'] if id_range['watermark'] is not None else id_range['start'] - 1
+        while True:
+            # Keyset pagination, claims failing to process stay CHECKED and must not be picked up again
+            chunk = list(checked_claims.filter(id__gt=last_id).values_list('id', flat=True)[:chunk_size])
+            if not chunk:
+                return errors
+            with transaction.atomic():
+                processed_claims = list(self._claims_for_processing(chunk))
+                for claim in processed_claims:
+                    errors += self._process_claim(claim)
+                # Processing can reject reviewed claims
+                self.update_statistics([claim.uuid for claim in processed_claims])
+                _record_extrapolation_watermark(claim_sampling_id, range_index, chunk[-1])
+            last_id = chunk[-1]
+
+    def _process_claim(self, claim):
+        # Savepoint per claim, a claim failing to process doesn't roll back the rest of its chunk
+        try:
+            with transaction.atomic():
+                return processing_claim(claim, self.user, True)
+        except Exception as exc:
+            logger.error("Error while processing extrapolated claim %s", claim.uuid, exc_info=exc)
+            return [{
+                'title': claim.code,
+                'list': [{
+                    'message': _("claim.mutation.failed_to_change_status_of_claim") % {'code': claim.code},
+                    'detail': str(exc)
+                }]
+            }]
+
+    def _claims_for_processing(self, claim_ids):
+        return Claim.objects.filter(id__in=claim_ids) \
+            .select_related('insuree', 'health_facility') \
+            .prefetch_related('items__policy', 'services__policy') \
+            .order_by('id')
+
+    def compute_deductible(self, claim_sampling):
+        """
+        Ratio of approved to adjusted amounts of the reviewed (delivered) claims of the batch, extrapolated to the
+        claims skipped from review. Approved and adjusted totals of items and services are summed from per-claim
+        subtotals grouped in correlated subqueries, so the whole batch is read with a single aggregate query no
+        matter how many items and services the claims have.
+
+        Returns:
+            dict: 'value' (ratio, None when no claim has been reviewed) together with the totals it comes from.
+        """
+        sampling = (claim_sampling.computed_value or {}).get('sampling', {})
+        claims = Claim.objects.filter(assignments__claim_batch=claim_sampling, *filter_validity())
+        if sampling.get('method') == 'monetary_unit':
+            return {'method': 'monetary_unit', 'value': self._monetary_unit_deductible(claims, sampling)}
+
+        totals = claims.filter(review_status=Claim.REVIEW_DELIVERED).annotate(**_review_totals_annotations()).aggregate(
+            reviewed=Count('id'),
+            items_approved=Sum('itm_approved'),
+            services_approved=Sum('srv_approved'),
+            items_adjusted=Sum('itm_adjusted'),
+            services_adjusted=Sum('srv_adjusted'),
+        )
+        deductible = {key: float(value or 0) for key, value in totals.items() if key != 'reviewed'}
+        approved = deductible['items_approved'] + deductible['services_approved']
+        adjusted = deductible['items_adjusted'] + deductible['services_adjusted']
+        deductible.update(
+            method=sampling.get('method', 'random'),
+            reviewed=totals['reviewed'],
+            value=approved / adjusted if adjusted else None
+        )
+        return deductible
+
+    def estimate_deductible(self, claim_sampling):
+        """
+        Ratio estimate of the deductible with its variance and confidence intervals, see
+        `estimators.ratio_estimate`, from the approved and adjusted amounts of every reviewed claim of the batch.
+        Claims of monetary-unit batches are weighted by the inverse of their probability to be drawn.
+        """
+        sampling = (claim_sampling.computed_value or {}).get('sampling', {})
+        totals = _review_totals_annotations()
+        reviewed = Claim.objects.filter(
+            *filter_validity(),
+            assignments__claim_batch=claim_sampling,
+            assignments__status=ClaimSamplingBatchAssignmentStatus.IDLE,
+            review_status=Claim.REVIEW_DELIVERED
+        ).annotate(**totals).values_list('claimed', *totals)
+
+        approved, adjusted, weights = [], [], []
+        for claimed, itm_approved, srv_approved, itm_adjusted, srv_adjusted in reviewed:
+            approved.append(float(itm_approved or 0) + float(srv_approved or 0))
+            adjusted.append(float(itm_adjusted or 0) + float(srv_adjusted or 0))
+            if sampling.get('method') == 'monetary_unit':
+                weights.append(max(1.0, sampling['interval'] / float(claimed)) if claimed else 0.0)
+
+        return ratio_estimate(
+            approved, adjusted,
+            population=ClaimSamplingBatchAssignment.objects.filter(
+                claim_batch=claim_sampling, is_deleted=False).count(),
+            weights=weights or None,
+            confidence=ClaimSamplingConfig.estimate_confidence,
+            bootstrap_samples=ClaimSamplingConfig.estimate_bootstrap_samples,
+        )
+
+    def get_deductible_estimate(self, claim_sampling_id):
+        """
+        Deductible estimate of a batch: the one its extrapolation was made with, otherwise a live `estimate_deductible`.
+        Live estimates are cached like the sampling summaries and invalidated with them, so that polling the summary
+        of a batch under review doesn't bootstrap the estimate on every request.
+        """
+        claim_sampling = get_sampling_batch(claim_sampling_id)
+        estimate = (claim_sampling.computed_value or {}).get('estimate')
+        if estimate:
+            return estimate
+
+        cache_key = _estimate_cache_key(claim_sampling_id)
+        estimate = cache.get(cache_key)
+        if estimate is None:
+            estimate = self.estimate_deductible(claim_sampling) or {}
+            cache.set(cache_key, estimate, ClaimSamplingConfig.summary_cache_ttl)
+        return estimate
+
+    def _statistics_deductible(self, claim_sampling):
+        """
+        Deductible read from the running review statistics of the batch, same as `compute_deductible` returns.
+        Statistics only follow reviews made through claim mutations and service calls, so their reviewed, delivered
+        and rejected counts are first checked against the batch with a single aggregate; claims reviewed some other
+        way are then brought into the statistics. None is returned for monetary-unit batches, whose deductible is
+        weighted, and for batches without statistics.
+        """
+        computed_value = claim_sampling.computed_value or {}
+        statistics = computed_value.get('statistics')
+        if not statistics or computed_value.get('sampling', {}).get('method') == 'monetary_unit':
+            return None
+        if not self._statistics_match(statistics, self._review_counts([claim_sampling.id]).get(str(claim_sampling.id))):
+            selected_claims = Claim.objects.filter(
+                *filter_validity(),
+                assignments__claim_batch=claim_sampling,
+                assignments__status=ClaimSamplingBatchAssignmentStatus.IDLE
+            )
+            self.update_statistics(selected_claims.values('uuid'))
+            statistics = get_sampling_batch(claim_sampling.id).computed_value['statistics']
+
+        approved = statistics['items_approved'] + statistics['services_approved']
+        adjusted = statistics['items_adjusted'] + statistics['services_adjusted']
+        return {
+            **{key: statistics[key] for key in
+               ('items_approved', 'services_approved', 'items_adjusted', 'services_adjusted')},
+            'method': computed_value.get('sampling', {}).get('method', 'random'),
+            'reviewed': statistics['delivered'],
+            'value': approved / adjusted if adjusted else None,
+        }
+
+    def _review_counts(self, claim_sampling_ids):
+        """
+        Number of reviewed, delivered and rejected claims selected for review in every batch, by batch id as a
+        string, counted with a single aggregate grouped by batch. Batches without selected claims are missing.
+        """
+        delivered = Q(review_status=Claim.REVIEW_DELIVERED)
+        return {
+            str(row.pop('claim_sampling_id')): row for row in Claim.objects.filter(
+                *filter_validity(),
+                assignments__claim_batch_id__in=claim_sampling_ids,
+                assignments__status=ClaimSamplingBatchAssignmentStatus.IDLE,
+                assignments__is_deleted=False
+            ).values(claim_sampling_id=F('assignments__claim_batch_id')).annotate(
+                reviewed=Count('id', filter=~Q(review_status=Claim.REVIEW_SELECTED)),
+                delivered=Count('id', filter=delivered),
+                rejected=Count('id', filter=delivered & Q(status=Claim.STATUS_REJECTED)),
+            ).order_by()
+        }
+
+    def _statistics_match(self, statistics, counts):
+        # Reviews made outside of the hooked mutations and service calls are not in the statistics
+        counts = counts or {'reviewed': 0, 'delivered': 0, 'rejected': 0}
+        return all(statistics.get(counter) == count for counter, count in counts.items())
 
-        return errors
+    def _monetary_unit_deductible(self, claims, sampling):
+        """
+        Horvitz-Thompson ratio of approved to adjusted amounts over the reviewed claims of a monetary-unit batch.
+        A claim was drawn with probability min(1, claimed / sampling interval), so each reviewed claim is weighted
+        by the inverse of that probability.
+        """
+        interval = sampling['interval']
+        reviewed = claims.filter(
+            review_status=Claim.REVIEW_DELIVERED,
+            assignments__status=ClaimSamplingBatchAssignmentStatus.IDLE
+        ).annotate(
+            approved_total=_claim_approved_exp(),
+            adjusted_total=_claim_adjusted_exp()
+        ).values_list('claimed', 'approved_total', 'adjusted_total')
+
+        weighted_approved, weighted_adjusted = 0.0, 0.0
+        for claimed, approved, adjusted in reviewed:
+            if not claimed:
+                continue
+            weight = max(1.0, interval / float(claimed))
+            weighted_approved += weight * float(approved or 0)
+            weighted_adjusted += weight * float(adjusted or 0)
+        return weighted_approved / weighted_adjusted if weighted_adjusted else None
+
+    def simulate_extrapolation(self, claim_sampling_id, deductibles=None):
+        """
+        Projects what `extrapolate_results` would do with each of the given deductibles, without writing anything.
+        Approved amounts of the claims that would be extrapolated are projected the way they would be recomputed
+        (price_approved = deductible * price_adjusted, rejected items and services excluded) and summed by health
+        facility and product. The projection is linear in the deductible, so the adjusted amounts to apply it to are
+        summed once per health facility, product and stratum, in a single query, and all scenarios are projected
+        from these totals.
+
+        Parameters:
+            claim_sampling_id: Id of the sampling batch.
+            deductibles (list): Deductible ratios to compare, applied to the whole batch. By default, the single
+                scenario the extrapolation would apply: the deductible of each stratum of the batch (see
+                `_stratum_deductibles`), the one computed from the whole review for strata without reviewed amounts.
+        Returns:
+            dict: 'deductibles', batch totals ('adjusted', 'current_approved', 'projected_approved' with one value
+            per deductible) and 'breakdown', the same totals for every health facility and product.
+        """
+        claim_sampling = get_sampling_batch(claim_sampling_id)
+        strata, stratum_deductibles = [], []
+        if not deductibles:
+            strata = self._extrapolation_strata(claim_sampling)
+            stratum_deductibles = self._stratum_deductibles(claim_sampling, strata) if strata else []
+            deductibles = [self.compute_deductible(claim_sampling)['value'] or 0]
+        deductibles = [float(deductible) for deductible in deductibles]
+        stratum_values = {
+            tuple(stratum['key'][key] for key in strata): stratum['value']
+            for stratum in stratum_deductibles if stratum['value'] is not None
+        }
+
+        claims = Claim.objects.filter(
+            *filter_validity(),
+            assignments__claim_batch=claim_sampling,
+            assignments__status=ClaimSamplingBatchAssignmentStatus.SKIPPED,
+            review_status=Claim.REVIEW_IDLE
+        )
+        rows = self._simulation_rows(ClaimItem, claims, strata)\
+            .union(self._simulation_rows(ClaimService, claims, strata), all=True)
+
+        breakdown = {}
+        for health_facility_id, product_id, *stratum_key, adjusted, current_approved, priced, unpriced in rows:
+            row = breakdown.setdefault((health_facility_id, product_id), {
+                'health_facility_id': health_facility_id,
+                'product_id': product_id,
+                'adjusted': 0.0,
+                'current_approved': 0.0,
+                'projected_approved': [0.0] * len(deductibles),
+            })
+            row['adjusted'] += float(adjusted or 0)
+            row['current_approved'] += float(current_approved or 0)
+            row['projected_approved'] = [
+                total + stratum_values.get(tuple(stratum_key), deductible) * float(priced or 0) + float(unpriced or 0)
+                for total, deductible in zip(row['projected_approved'], deductibles)
+            ]
+
+        breakdown = sorted(breakdown.values(), key=lambda row: (row['health_facility_id'], row['product_id'] or 0))
+        return {
+            'deductibles': deductibles,
+            'adjusted': sum(row['adjusted'] for row in breakdown),
+            'current_approved': sum(row['current_approved'] for row in breakdown),
+            'projected_approved': [sum(row['projected_approved'][index] for row in breakdown)
+                                   for index in range(len(deductibles))],
+            'breakdown': breakdown,
+        }
+
+    def _simulation_rows(self, detail_model, claims, strata):
+        # Extrapolated prices are deductible * price_adjusted, price_asked is kept when there is no adjusted price
+        stratum_columns = [_stratum_column(key) for key in strata]
+        priced = Q(price_adjusted__isnull=False)
+        return detail_model.objects.filter(*filter_validity(), claim__in=claims)\
+            .filter(Q(rejection_reason__isnull=True) | Q(rejection_reason=0))\
+            .annotate(**_stratum_expressions(strata, prefix='claim__'))\
+            .values('claim__health_facility_id', 'product_id', *stratum_columns)\
+            .annotate(
+                adjusted=Sum(elm_adjusted_exp()),
+                current_approved=Sum(elm_approved_exp()),
+                priced=Sum(ExpressionWrapper(F('price_adjusted') * elm_qty_exp(), output_field=DecimalField()),
+                           filter=priced),
+                unpriced=Sum(ExpressionWrapper(F('price_asked') * elm_qty_exp(), output_field=DecimalField()),
+                             filter=~priced),
+            )\
+            .values_list('claim__health_facility_id', 'product_id', *stratum_columns, 'adjusted', 'current_approved',
+                         'priced', 'unpriced')\
+            .order_by()
+
+    def get_sampling_summary(self, claim_sampling_id):
+        """
+        Summary of the review of a single batch, see `get_sampling_summaries`.
+        """
+        return self.get_sampling_summaries([claim_sampling_id])[claim_sampling_id]
+
+    def get_sampling_summaries(self, claim_sampling_ids):
+        """
+        Review summaries of several batches: number of claims selected for review ('total'), how many of them were
+        reviewed ('reviewed'), had their review delivered ('delivered') and were rejected in review ('rejected'),
+        with the claimed amount of the selected claims ('claimed') and the approved amount of the delivered ones
+        ('approved'). Summaries are read from the running review statistics of the batches, whose reviewed,
+        delivered and rejected counts are checked with one grouped count (see `_review_counts`). Batches without
+        statistics or whose statistics missed reviews are counted with one aggregate over assignments joined to
+        claims, grouped by batch.
+
+        Summaries are cached for `summary_cache_ttl` seconds, only the batches missing from the cache are read.
+        The cache is invalidated when the statistics of a batch change and when the batch is extrapolated.
+
+        Returns:
+            dict: Summary of every batch, by batch id.
+        """
+        cache_keys = {claim_sampling_id: _summary_cache_key(claim_sampling_id)
+                      for claim_sampling_id in claim_sampling_ids}
+        cached = cache.get_many(cache_keys.values())
+        summaries = {claim_sampling_id: cached[cache_key] for claim_sampling_id, cache_key in cache_keys.items()
+                     if cache_key in cached}
+
+        missing_ids = [claim_sampling_id for claim_sampling_id in cache_keys if claim_sampling_id not in summaries]
+        if missing_ids:
+            statistics = {
+                str(claim_sampling_id): (computed_value or {}).get('statistics') or {}
+                for claim_sampling_id, computed_value in ClaimSamplingBatch.objects
+                .filter(id__in=missing_ids).values_list('id', 'computed_value')
+            }
+            complete = {
+                claim_sampling_id: batch_statistics for claim_sampling_id, batch_statistics in statistics.items()
+                if all(counter in batch_statistics for counter in ('selected', 'claimed', *STATISTICS_COUNTERS))
+            }
+            review_counts = self._review_counts(list(complete)) if complete else {}
+            counted = {
+                claim_sampling_id: self._statistics_summary(batch_statistics)
+                for claim_sampling_id, batch_statistics in complete.items()
+                if self._statistics_match(batch_statistics, review_counts.get(claim_sampling_id))
+            }
+            uncounted_ids = [claim_sampling_id for claim_sampling_id in statistics if claim_sampling_id not in counted]
+            if uncounted_ids:
+                counted.update(self._count_sampling_summaries(uncounted_ids))
+            empty = {'total': 0, 'reviewed': 0, 'delivered': 0, 'rejected': 0, 'claimed': 0, 'approved': 0}
+            missing = {claim_sampling_id: counted.get(str(claim_sampling_id), empty)
+                       for claim_sampling_id in missing_ids}
+            cache.set_many({cache_keys[claim_sampling_id]: summary for claim_sampling_id, summary in missing.items()},
+                           ClaimSamplingConfig.summary_cache_ttl)
+            summaries.update(missing)
+        return summaries
+
+    def _statistics_summary(self, statistics):
+        return {
+            'total': statistics['selected'],
+            'reviewed': statistics['reviewed'],
+            'delivered': statistics['delivered'],
+            'rejected': statistics['rejected'],
+            'claimed': statistics['claimed'],
+            'approved': statistics['approved'],
+        }
+
+    def _count_sampling_summaries(self, claim_sampling_ids):
+        delivered = Q(review_status=Claim.REVIEW_DELIVERED)
+        return {
+            str(row.pop('claim_sampling_id')): row for row in Claim.objects.filter(
+                assignments__claim_batch_id__in=claim_sampling_ids,
+                assignments__status=ClaimSamplingBatchAssignmentStatus.IDLE
+            ).values(claim_sampling_id=F('assignments__claim_batch_id')).annotate(
+                total=Count('id'),
+                reviewed=Count('id', filter=~Q(review_status=Claim.REVIEW_SELECTED)),
+                delivered=Count('id', filter=delivered),
+                rejected=Count('id', filter=delivered & Q(status=Claim.STATUS_REJECTED)),
+                claimed=Coalesce(Sum('claimed'), 0, output_field=DecimalField()),
+                approved=Coalesce(Sum('approved', filter=delivered), 0, output_field=DecimalField()),
+            ).order_by()
+        }
+
+    def get_batch_claims_page(self, claim_sampling_id, assignment_status=None, first=None, after=None,
+                              claims=None):
+        """
+        Page of the valid claims of a sampling batch, ordered by assignment status then claim id. Claims are joined
+        to their assignment and the page starts after the `after` cursor with a keyset condition on that ordering
+        instead of an offset, the (batch, status, claim) index of assignments serves both the condition and the
+        ordering so that reading page N costs the same as reading the first one.
+
+        Parameters:
+            claim_sampling_id: Id of the sampling batch.
+            assignment_status (str): Only claims with this assignment status, optional.
+            first (int): Size of the page, `batch_claims_page_size` by default, `batch_claims_max_page_size` at most.
+            after (str): Cursor of the last claim of the previous page, None for the first page.
+            claims (QuerySet): Claims the page is taken from, e.g. restricted by row security, all by default.
+        Returns:
+            tuple: Claims of the page, cursor of its last claim (None for an empty page) and whether a next page
+            exists.
+        """
+        first = min(first or ClaimSamplingConfig.batch_claims_page_size, ClaimSamplingConfig.batch_claims_max_page_size)
+        # Assignments of released batches are soft deleted
+        assignment_filters = {'assignments__claim_batch_id': claim_sampling_id, 'assignments__is_deleted': False}
+        if assignment_status:
+            assignment_filters['assignments__status'] = assignment_status
+        page = (Claim.objects.all() if claims is None else claims) \
+            .filter(validity_to__isnull=True, **assignment_filters) \
+            .annotate(assignment_status=F('assignments__status'),
+                      claim_sampling_batch_id=F('assignments__claim_batch_id'))
+
+        if after:
+            after_status, after_id = _decode_claims_cursor(after)
+            page = page.filter(
+                Q(assignment_status__gt=after_status) | Q(assignment_status=after_status, id__gt=after_id))
+
+        rows = list(page.order_by('assignment_status', 'id')[:first + 1])
+        page_claims = rows[:first]
+        end_cursor = _encode_claims_cursor(page_claims[-1].assignment_status, page_claims[-1].id) \
+            if page_claims else None
+        return page_claims, end_cursor, len(rows) > first
+
+    def export_batch_rows(self, claim_sampling_id, claims=None):
+        """
+        Rows of the valid claims of a batch for exports, as tuples of BATCH_EXPORT_COLUMNS ordered by claim id. Rows
+        are fetched `export_chunk_size` at a time from a server-side cursor where the database supports it, so the
+        memory used doesn't depend on the size of the batch.
+
+        Parameters:
+            claim_sampling_id: Id of the sampling batch.
+            claims (QuerySet): Claims the rows are taken from, e.g. restricted by row security, all by default.
+        """
+        return (Claim.objects.all() if claims is None else claims) \
+            .filter(validity_to__isnull=True, assignments__claim_batch_id=claim_sampling_id,
+                    assignments__is_deleted=False) \
+            .annotate(assignment_status=F('assignments__status'), adjusted=_claim_adjusted_exp()) \
+            .order_by('id') \
+            .values_list(*BATCH_EXPORT_FIELDS) \
+            .iterator(chunk_size=ClaimSamplingConfig.export_chunk_size)
 
     def prepare_sampling_summary(self, claim_sampling_id):
         relevant_claims = self._get_sampling_claims(claim_sampling_id)
@@ -173,21 +1685,49 @@ class ClaimSamplingService(BaseService):
         return rejected_from_review, reviewed_delivered, total
 
     def apply_claim_item_service_deduction(self, claim, deduction_rate):
-        claim_items = claim.items.all()
+        self.apply_bulk_item_service_deduction(Claim.objects.filter(id=claim.id), deduction_rate)
 
-        for item in claim_items:
-            new_claim_item = item
-            if new_claim_item.price_approved:
-                new_claim_item.price_approved *= (100-deduction_rate)/100
-                new_claim_item.save()
+    @transaction.atomic
+    def apply_bulk_item_service_deduction(self, claims, deduction_rate, overrides=None):
+        """
+        Deducts `deduction_rate` percent from the approved price of the valid items and services of `claims`, then
+        recomputes the approved amount of the claims. Each table is updated with a single UPDATE.
 
-        claim_services = claim.services.all()
+        Parameters:
+            claims (QuerySet): Claims to apply the deduction to.
+            deduction_rate (number): Percentage deducted from approved prices.
+            overrides (dict): Optional deduction rates of specific claims, by claim id. They are loaded into a
+                temporary table read by a second UPDATE per table, so the number of overrides doesn't grow the
+                statements.
+        """
+        factor = Value((100 - deduction_rate) / 100, output_field=DecimalField())
+        if not overrides:
+            for detail_model in (ClaimItem, ClaimService):
+                self.__deduct_details(detail_model, claims, factor)
+        else:
+            with _temporary_claim_factors({
+                claim_id: (100 - rate) / 100 for claim_id, rate in overrides.items()
+            }) as factors_table:
+                overridden_claims = RawSQL(f"SELECT claim_id FROM {factors_table}", [])
+                for detail_model in (ClaimItem, ClaimService):
+                    self.__deduct_details(detail_model, claims.exclude(id__in=overridden_claims), factor)
+                    self.__deduct_details(detail_model, claims.filter(id__in=overridden_claims),
+                                          self.__claim_factor(detail_model, factors_table))
+
+        _update_claims_approved(claims)
 
-        for service in claim_services:
-            new_claim_service = service
-            if new_claim_service.price_approved:
-                new_claim_service.price_approved *= (100-deduction_rate)/100
-                new_claim_service.save()
+    def __deduct_details(self, detail_model, claims, factor):
+        detail_model.objects.filter(*filter_validity(), claim__in=claims, price_approved__isnull=False)\
+            .update(price_approved=ExpressionWrapper(F('price_approved') * factor, output_field=DecimalField()))
+
+    def __claim_factor(self, detail_model, factors_table):
+        quote_name = connection.ops.quote_name
+        claim_column = f"{quote_name(detail_model._meta.db_table)}." \
+                       f"{quote_name(detail_model._meta.get_field('claim').column)}"
+        return RawSQL(
+            f"(SELECT factors.factor FROM {factors_table} factors WHERE factors.claim_id = {claim_column})", [],
+            output_field=DecimalField()
+        )
 
     def _get_sampling_claims(self, claim_sampling_id, include_skip=False):
         assigned_claims = ClaimSamplingBatchAssignment.objects.filter(claim_batch_id=claim_sampling_id)
@@ -207,13 +1747,19 @@ class ClaimSamplingService(BaseService):
         super().__init__(user, validation_class)
 
     def __choose_random_claims_for_review(self, total_elements: int, percentage: int):
+        return self.__shuffled_statuses(total_elements, self.__sample_size(total_elements, percentage))
+
+    def __sample_size(self, total_elements: int, percentage: int):
         selected_for_review = int((percentage/100.0) * total_elements)
-        not_selected = total_elements - selected_for_review
 
         # Ensure at least one claim is selected for review
-        if selected_for_review == 0 and not_selected > 0:
+        if selected_for_review == 0 and total_elements > 0:
             selected_for_review += 1
-            not_selected -= 1
+
+        return selected_for_review
+
+    def __shuffled_statuses(self, total_elements: int, selected_for_review: int):
+        not_selected = total_elements - selected_for_review
 
         # Create the matching number of claims
         result_list = [ClaimSamplingBatchAssignmentStatus.IDLE] * selected_for_review + \
@@ -1,6 +1,7 @@
 import logging
 
 from claim.models import Claim
+from claim_sampling.apps import ClaimSamplingConfig
 from claim_sampling.models import ClaimSamplingBatchAssignment
 from claim_sampling.services import ClaimSamplingService
 from core.models import User
@@ -14,11 +15,13 @@ logger = logging.getLogger(__name__)
 
 
 def _resolve_task_any(_task: Task, _user: User):
-    claim_sampling_id = _task.data['data']['uuid']
     claim_sampling_service = ClaimSamplingService(user=_user)
 
-    rejected_from_review = claim_sampling_service\
-        .extrapolate_results(claim_sampling_id)
+    # The task is completed once the extrapolation ends, resolve_task doesn't wait for it
+    if ClaimSamplingConfig.async_extrapolation:
+        claim_sampling_service.extrapolate_task_async(_task.id)
+    else:
+        claim_sampling_service.extrapolate_task(_task.id)
 
 
 def _resolve_task_all(_task, _user):
@@ -63,9 +66,50 @@ def on_claim_sampling_resolve_task(**kwargs):
         return [str(e)]
 
 
+# Claim mutations changing the review of claims, after which the statistics of their sampling batches are updated
+REVIEW_MUTATIONS = {
+    'SaveClaimReviewMutation',
+    'DeliverClaimsReviewMutation',
+    'SkipClaimsReviewMutation',
+    'BypassClaimsReviewMutation',
+    'ProcessClaimsMutation',
+}
+
+
+def on_claim_review_after_mutation(sender, **kwargs):
+    # Statistics are recomputed from the claims, also when the mutation failed for some of them
+    if kwargs.get('mutation_class', None) not in REVIEW_MUTATIONS:
+        return []
+    data = kwargs.get('data', None) or {}
+    claim_uuids = data.get('uuids') or ([data['claim_uuid']] if data.get('claim_uuid') else [])
+    try:
+        ClaimSamplingService(user=kwargs['user']).update_statistics(claim_uuids)
+    except Exception as e:
+        logger.error("Error while updating claim sampling statistics", exc_info=e)
+    return []
+
+
+def on_claim_submit_service_signal(**kwargs):
+    # Claims submitted again while selected for review can come back rejected
+    try:
+        result = kwargs.get('result', None)
+        if result:
+            claim, _errors = result
+            ClaimSamplingService(user=kwargs['cls_'].user).update_statistics([claim.uuid])
+    except Exception as e:
+        logger.error("Error while updating claim sampling statistics", exc_info=e)
+        return [str(e)]
+
+
 def bind_service_signals():
     bind_service_signal(
         'task_service.resolve_task',
         on_claim_sampling_resolve_task,
         bind_type=ServiceSignalBindType.AFTER
     )
+    # enter_and_submit_claim submits through submit_claim as well
+    bind_service_signal(
+        'claim.submit_claim',
+        on_claim_submit_service_signal,
+        bind_type=ServiceSignalBindType.AFTER
+    )
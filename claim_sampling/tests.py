@@ -1,11 +1,15 @@
 from graphql_jwt.shortcuts import get_token
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
 from unittest import mock
 
 from claim.services import ClaimSubmitService
 from claim.tests.tests import DummyContext
-from core.test_helpers import create_test_interactive_user, create_test_officer
-from location.test_helpers import create_test_location, create_test_health_facility, create_test_village
+from core.test_helpers import create_test_interactive_user, create_test_officer, create_test_role
+from location.test_helpers import create_test_location, create_test_health_facility, create_test_village, \
+    assign_user_districts
 from insuree.test_helpers import create_test_insuree
 from claim.test_helpers import create_test_claim_admin, create_test_claim, mark_test_claim_as_processed
 from claim.models import Claim, ClaimItem, ClaimService, ClaimDetail
@@ -15,10 +19,15 @@ from django.conf import settings
 from .models import (
     ClaimSamplingBatch,
     ClaimSamplingBatchAssignment,
-    ClaimSamplingBatchAssignmentStatus
+    ClaimSamplingBatchAssignmentStatus,
+    ClaimSamplingSnapshot
 )
 
-from .services import ClaimSamplingService
+from .services import ClaimSamplingService, allocate_stratified_sample, invalidate_sampling_summaries, \
+    get_sampling_batch, BATCH_EXPORT_COLUMNS
+from .estimators import ratio_estimate
+from .gql_queries import ClaimSamplingBatchGQLType
+from .views import export_batch
 import core
 from graphene import Schema
 from graphene_django.utils.testing import GraphQLTestCase
@@ -28,7 +37,12 @@ from policy.test_helpers import create_test_policy2
 from product.test_helpers import create_test_product, create_test_product_service, create_test_product_item
 from medical_pricelist.test_helpers import add_service_to_hf_pricelist, add_item_to_hf_pricelist
 from product.models import ProductItemOrService
+from tasks_management.models import Task
+from tasks_management.services import TaskService
+from .apps import ClaimSamplingConfig
 from datetime import date, timedelta, datetime
+import json
+import uuid
 class ClaimSubmitServiceTestCase(GraphQLTestCase):
     GRAPHQL_URL = f'/{settings.SITE_ROOT()}graphql'
     # This is required by some version of graphene but is never used. It should be set to the schema but the import
@@ -213,10 +227,19 @@ mutation {{
         claim_3.save()
 
         service = ClaimSamplingService(self.admin_user)
+        # As done after claim review mutations
+        service.update_statistics([claim_1.uuid, claim_2.uuid, claim_3.uuid])
         rejected_from_review, reviewed_delivered, total = service.prepare_sampling_summary(claim_sampling.id)
         self.assertEqual(rejected_from_review.count(), 2)
         self.assertEqual(reviewed_delivered.count(), 3)
         self.assertEqual(total, 3)
+        # Statistics of the batch, then the check of their counts
+        with self.assertNumQueries(2):
+            summary = service.get_sampling_summary(claim_sampling.id)
+        self.assertEqual({counter: summary[counter] for counter in ('total', 'reviewed', 'delivered', 'rejected')},
+                         {'total': 3, 'reviewed': 3, 'delivered': 3, 'rejected': 2})
+        self.assertEqual(service.get_sampling_summaries([claim_sampling.id, uuid.uuid4()])[claim_sampling.id],
+                         summary)
         datetimeclaim = datetime.now() - timedelta(days=5)
 
         # Extrapolation
@@ -232,6 +255,567 @@ mutation {{
         # FIXME check the ratio (done manually looks ok)
         
 
+    def test_preview_does_not_create_batch(self):
+        service = ClaimSamplingService(self.admin_user)
+        claims = Claim.objects.filter(id__in=[claim.id for claim in self.test_claims])
+        preview = service.preview({'percentage': 30, 'uuids': claims.values_list('uuid', flat=True)})
+
+        self.assertEqual(preview['matched'], 10)
+        self.assertEqual(preview['already_assigned'], 0)
+        self.assertEqual(preview['to_assign'], 10)
+        self.assertEqual(preview['sample_size'], 3)
+        total_claimed = sum(claim.claimed for claim in claims)
+        self.assertAlmostEqual(preview['claimed_in_review'], float(total_claimed) * 0.3)
+        self.assertAlmostEqual(preview['claimed_in_review'] + preview['claimed_skipped'], float(total_claimed))
+        self.assertFalse(ClaimSamplingBatch.objects.exists())
+        self.assertFalse(ClaimSamplingBatchAssignment.objects.exists())
+
+    def test_deductible_single_query(self):
+        service, claims, claim_sampling = self._create_test_batch(10)
+
+        reviewed = ClaimSamplingBatchAssignment.objects.get(
+            claim_batch=claim_sampling, status=ClaimSamplingBatchAssignmentStatus.IDLE).claim
+        reviewed.review_status = Claim.REVIEW_DELIVERED
+        reviewed.save()
+        # A second service would multiply rows of a join on services
+        ClaimService.objects.create(
+            claim=reviewed,
+            service=Service.objects.filter(code="ssamCo", validity_to__isnull=True).first(),
+            price_asked=1000,
+            qty_provided=1,
+            audit_user_id=-1,
+            status=ClaimDetail.STATUS_PASSED,
+        )
+        reviewed.items.update(status=ClaimDetail.STATUS_REJECTED)
+
+        with self.assertNumQueries(1):
+            deductible = service.compute_deductible(claim_sampling)
+
+        self.assertEqual(deductible['reviewed'], 1)
+        self.assertEqual(deductible['items_approved'], 0)
+        self.assertEqual(deductible['services_approved'], deductible['services_adjusted'])
+        self.assertEqual(deductible['services_adjusted'], 2 * deductible['items_adjusted'])
+        self.assertAlmostEqual(deductible['value'], 2 / 3)
+
+    def test_checked_claim_ranges_are_disjoint(self):
+        service = ClaimSamplingService(self.admin_user)
+        claims = Claim.objects.filter(id__in=[claim.id for claim in self.test_claims], status=Claim.STATUS_CHECKED)
+
+        id_ranges = service._checked_claim_ranges(claims, 3)
+
+        self.assertEqual(len(id_ranges), 3)
+        covered = [claim_id for claim_id in claims.values_list('id', flat=True)
+                   if any(start <= claim_id <= end for start, end in id_ranges)]
+        self.assertEqual(len(covered), claims.count())
+        for (_, end), (next_start, _) in zip(id_ranges, id_ranges[1:]):
+            self.assertLess(end, next_start)
+
+    def test_extrapolation_resumes_from_checkpoint(self):
+        service, claims, claim_sampling = self._create_test_batch()
+        checkpoint = service._extrapolate_prices(claim_sampling, claims.filter(assignments__claim_batch=claim_sampling))
+        first_range = checkpoint['ranges'][0]
+        # Interrupted after the first claim has been processed
+        service._process_checked_claims(
+            claim_sampling.id, Claim.objects.filter(id=first_range['start']), 0, first_range)
+
+        with mock.patch.object(service, '_extrapolate_prices') as extrapolate_prices:
+            service.extrapolate_results(claim_sampling.id)
+            extrapolate_prices.assert_not_called()
+
+        claim_sampling.refresh_from_db()
+        extrapolation = claim_sampling.computed_value['extrapolation']
+        self.assertEqual(extrapolation['phase'], 'COMPLETED')
+        self.assertEqual(extrapolation['ranges'][0]['watermark'], first_range['end'])
+        self.assertFalse(claims.filter(status=Claim.STATUS_CHECKED).exists())
+
+    def test_statistics_updates_are_idempotent(self):
+        service, claims, claim_sampling = self._create_test_batch()
+        selected = [assignment.claim for assignment in ClaimSamplingBatchAssignment.objects.filter(
+            claim_batch=claim_sampling, status=ClaimSamplingBatchAssignmentStatus.IDLE)]
+        for claim in selected[:2]:
+            claim.review_status = Claim.REVIEW_DELIVERED
+            claim.save()
+        selected[1].status = Claim.STATUS_REJECTED
+        selected[1].save()
+
+        service.update_statistics([claim.uuid for claim in selected])
+        service.update_statistics([claim.uuid for claim in selected])
+
+        claim_sampling.refresh_from_db()
+        statistics = claim_sampling.computed_value['statistics']
+        self.assertEqual(statistics['selected'], 3)
+        self.assertEqual(statistics['reviewed'], 2)
+        self.assertEqual(statistics['delivered'], 2)
+        self.assertEqual(statistics['rejected'], 1)
+        deductible = service.compute_deductible(claim_sampling)
+        self.assertAlmostEqual(statistics['services_adjusted'], deductible['services_adjusted'])
+        self.assertAlmostEqual(service._statistics_deductible(claim_sampling)['value'], deductible['value'])
+
+    def test_statistics_deductible_brings_stale_statistics_up_to_date(self):
+        service, claims, claim_sampling = self._create_test_batch()
+        selected = [assignment.claim for assignment in ClaimSamplingBatchAssignment.objects.filter(
+            claim_batch=claim_sampling, status=ClaimSamplingBatchAssignmentStatus.IDLE)]
+        # Reviewed without going through claim mutations, statistics are not updated
+        selected[0].review_status = Claim.REVIEW_DELIVERED
+        selected[0].status = Claim.STATUS_REJECTED
+        selected[0].save()
+
+        claim_sampling.refresh_from_db()
+        self.assertEqual(claim_sampling.computed_value['statistics']['delivered'], 0)
+        deductible = service._statistics_deductible(claim_sampling)
+
+        self.assertAlmostEqual(deductible['value'], service.compute_deductible(claim_sampling)['value'])
+        summary = service.get_sampling_summary(claim_sampling.id)
+        self.assertEqual({counter: summary[counter] for counter in ('total', 'reviewed', 'delivered', 'rejected')},
+                         {'total': 3, 'reviewed': 1, 'delivered': 1, 'rejected': 1})
+        self.assertEqual(summary['claimed'], 6000)
+
+    def test_simulation_matches_stratified_extrapolation(self):
+        claim_ids = list(Claim.objects.filter(id__in=[claim.id for claim in self.test_claims])
+                         .order_by('id').values_list('id', flat=True))
+        Claim.objects.filter(id__in=claim_ids[:3]).update(care_type='I')
+        Claim.objects.filter(id__in=claim_ids[3:]).update(care_type='O')
+        service, claims, claim_sampling = self._create_test_batch(percentage=40, strata=['care_type'])
+        ClaimItem.objects.filter(claim__in=claims).update(price_adjusted=1000)
+        ClaimService.objects.filter(claim__in=claims).update(price_adjusted=1000)
+        reviewed = claims.filter(assignments__claim_batch=claim_sampling,
+                                 assignments__status=ClaimSamplingBatchAssignmentStatus.IDLE)
+        reviewed.update(review_status=Claim.REVIEW_DELIVERED)
+        # Inpatient claims are half approved in review, outpatient ones fully
+        for detail_model in (ClaimItem, ClaimService):
+            detail_model.objects.filter(claim__in=reviewed.filter(care_type='I')).update(price_approved=500)
+            detail_model.objects.filter(claim__in=reviewed.filter(care_type='O')).update(price_approved=1000)
+
+        simulation = service.simulate_extrapolation(claim_sampling.id)
+        batch_wide = service.simulate_extrapolation(claim_sampling.id, simulation['deductibles'])
+
+        claim_sampling = get_sampling_batch(claim_sampling.id)
+        service._extrapolate_prices(claim_sampling, claims.filter(assignments__claim_batch=claim_sampling))
+        extrapolated = claims.filter(assignments__claim_batch=claim_sampling,
+                                     assignments__status=ClaimSamplingBatchAssignmentStatus.SKIPPED)
+        extrapolated_approved = sum(
+            float(detail.price_approved) * float(detail.qty_approved or detail.qty_provided)
+            for detail_model in (ClaimItem, ClaimService)
+            for detail in detail_model.objects.filter(claim__in=extrapolated, validity_to__isnull=True)
+        )
+        self.assertAlmostEqual(simulation['projected_approved'][0], extrapolated_approved, places=2)
+        self.assertNotAlmostEqual(batch_wide['projected_approved'][0], extrapolated_approved, places=2)
+
+    def test_summary_counts_claims_when_statistics_missed_reviews(self):
+        service, claims, claim_sampling = self._create_test_batch()
+        selected = ClaimSamplingBatchAssignment.objects.filter(
+            claim_batch=claim_sampling, status=ClaimSamplingBatchAssignmentStatus.IDLE).first().claim
+        # Reviewed without going through claim mutations, statistics are not updated
+        Claim.objects.filter(id=selected.id).update(review_status=Claim.REVIEW_DELIVERED,
+                                                    status=Claim.STATUS_REJECTED)
+
+        summary = service.get_sampling_summary(claim_sampling.id)
+
+        self.assertEqual({counter: summary[counter] for counter in ('total', 'reviewed', 'delivered', 'rejected')},
+                         {'total': 3, 'reviewed': 1, 'delivered': 1, 'rejected': 1})
+
+    def test_live_estimate_is_cached_with_summary(self):
+        service, claims, claim_sampling = self._create_test_batch()
+        with mock.patch.object(service, 'estimate_deductible', wraps=service.estimate_deductible) as estimate:
+            first = service.get_deductible_estimate(claim_sampling.id)
+            self.assertEqual(service.get_deductible_estimate(claim_sampling.id), first)
+            self.assertEqual(estimate.call_count, 1)
+
+            invalidate_sampling_summaries([claim_sampling.id])
+            service.get_deductible_estimate(claim_sampling.id)
+            self.assertEqual(estimate.call_count, 2)
+
+    def test_simulate_extrapolation_does_not_write(self):
+        service, claims, claim_sampling = self._create_test_batch()
+        ClaimItem.objects.filter(claim__in=claims).update(price_adjusted=1000)
+        ClaimService.objects.filter(claim__in=claims).update(price_adjusted=1000)
+
+        prices_approved = list(ClaimItem.objects.filter(claim__in=claims).order_by('id')
+                               .values_list('price_approved', flat=True))
+
+        simulation = service.simulate_extrapolation(claim_sampling.id, [0.5, 1])
+
+        # 7 skipped claims with one item and one service each
+        self.assertAlmostEqual(simulation['adjusted'], 14000)
+        self.assertEqual([round(value) for value in simulation['projected_approved']], [7000, 14000])
+        self.assertEqual({row['health_facility_id'] for row in simulation['breakdown']}, {self.test_hf.id})
+        self.assertEqual(prices_approved, list(ClaimItem.objects.filter(claim__in=claims).order_by('id')
+                                               .values_list('price_approved', flat=True)))
+        claim_sampling.refresh_from_db()
+        self.assertNotIn('deductible', claim_sampling.computed_value)
+
+    def test_bulk_item_service_deduction(self):
+        service = ClaimSamplingService(self.admin_user)
+        claims = Claim.objects.filter(id__in=[claim.id for claim in self.test_claims])
+        overridden = self.test_claims[0]
+        ClaimItem.objects.filter(claim__in=claims).update(price_approved=1000)
+        ClaimService.objects.filter(claim__in=claims).update(price_approved=1000)
+
+        service.apply_bulk_item_service_deduction(claims, 10, overrides={overridden.id: 50})
+
+        self.assertEqual(
+            set(ClaimItem.objects.filter(claim__in=claims).exclude(claim=overridden)
+                .values_list('price_approved', flat=True)), {900})
+        self.assertEqual(overridden.items.get().price_approved, 500)
+        self.assertEqual(overridden.services.get().price_approved, 500)
+        self.assertEqual(Claim.objects.get(id=overridden.id).approved, 1000)
+
+    def test_bulk_deduction_sums_every_item_and_service(self):
+        service = ClaimSamplingService(self.admin_user)
+        claims = Claim.objects.filter(id__in=[claim.id for claim in self.test_claims[:2]])
+        for claim in claims:
+            item, claim_service = claim.items.get(), claim.services.get()
+            for _ in range(2):
+                ClaimItem.objects.create(
+                    claim=claim, item=item.item, price_asked=1000, qty_provided=1, audit_user_id=-1,
+                    status=ClaimDetail.STATUS_PASSED, availability=True, validity_from=item.validity_from)
+                ClaimService.objects.create(
+                    claim=claim, service=claim_service.service, price_asked=1000, qty_provided=1, audit_user_id=-1,
+                    status=ClaimDetail.STATUS_PASSED, validity_from=claim_service.validity_from)
+        ClaimItem.objects.filter(claim__in=claims).update(price_approved=1000)
+        ClaimService.objects.filter(claim__in=claims).update(price_approved=1000)
+
+        service.apply_bulk_item_service_deduction(claims, 10)
+
+        # Three items and three services of 1000 each, 10% deducted
+        self.assertEqual(set(claims.values_list('approved', flat=True)), {5400})
+
+    def test_stratum_deductibles(self):
+        service, claims, claim_sampling = self._create_test_batch()
+        reviewed = ClaimSamplingBatchAssignment.objects.filter(
+            claim_batch=claim_sampling, status=ClaimSamplingBatchAssignmentStatus.IDLE).first().claim
+        reviewed.review_status = Claim.REVIEW_DELIVERED
+        reviewed.save()
+        reviewed.items.update(status=ClaimDetail.STATUS_REJECTED)
+
+        stratum_deductibles = service._stratum_deductibles(claim_sampling, ['health_facility', 'care_type'])
+
+        self.assertEqual(len(stratum_deductibles), 1)
+        self.assertEqual(stratum_deductibles[0]['key'],
+                         {'health_facility': self.test_hf.id, 'care_type': reviewed.care_type})
+        self.assertAlmostEqual(stratum_deductibles[0]['value'], service.compute_deductible(claim_sampling)['value'])
+
+    def test_rollback_extrapolation(self):
+        service, claims, claim_sampling = self._create_test_batch()
+        ClaimItem.objects.filter(claim__in=claims).update(price_adjusted=1000, price_approved=800)
+        skipped = claims.filter(assignments__status=ClaimSamplingBatchAssignmentStatus.SKIPPED)
+        approved_before = dict(skipped.values_list('id', 'approved'))
+        status_before = dict(claims.values_list('id', 'status'))
+        processing_before = set(claims.values_list('id', 'process_stamp', 'date_processed', 'audit_user_id_process'))
+
+        service.extrapolate_results(claim_sampling.id)
+        self.assertFalse(skipped.filter(review_status=Claim.REVIEW_IDLE).exists())
+        self.assertFalse(claims.filter(status=Claim.STATUS_CHECKED).exists())
+
+        service.rollback_extrapolation(claim_sampling.id)
+
+        self.assertEqual(set(skipped.values_list('review_status', flat=True)), {Claim.REVIEW_IDLE})
+        self.assertEqual(dict(skipped.values_list('id', 'approved')), approved_before)
+        self.assertEqual(dict(claims.values_list('id', 'status')), status_before)
+        self.assertEqual(set(claims.values_list('id', 'process_stamp', 'date_processed', 'audit_user_id_process')),
+                         processing_before)
+        self.assertEqual(set(ClaimItem.objects.filter(claim__in=skipped).values_list('price_approved', flat=True)),
+                         {800})
+        self.assertFalse(ClaimSamplingSnapshot.objects.filter(claim_batch=claim_sampling).exists())
+
+    def test_rollback_refused_once_claims_are_remunerated(self):
+        service, claims, claim_sampling = self._create_test_batch()
+        service.extrapolate_results(claim_sampling.id)
+        remunerated = claims.filter(assignments__status=ClaimSamplingBatchAssignmentStatus.SKIPPED).first()
+        Claim.objects.filter(id=remunerated.id).update(remunerated=1000)
+
+        with self.assertRaises(ValueError):
+            service.rollback_extrapolation(claim_sampling.id)
+        self.assertTrue(ClaimSamplingSnapshot.objects.filter(claim_batch=claim_sampling).exists())
+
+    def test_batch_claims_keyset_pages(self):
+        service, claims, claim_sampling = self._create_test_batch()
+
+        pages, after, has_next_page = [], None, True
+        while has_next_page:
+            with self.assertNumQueries(1):
+                page, after, has_next_page = service.get_batch_claims_page(claim_sampling.id, first=4, after=after)
+            pages.append(page)
+
+        self.assertEqual([len(page) for page in pages], [4, 4, 2])
+        keys = [(claim.assignment_status, claim.id) for page in pages for claim in page]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual({claim_id for _, claim_id in keys}, set(claims.values_list('id', flat=True)))
+
+        skipped, _, _ = service.get_batch_claims_page(
+            claim_sampling.id, assignment_status=ClaimSamplingBatchAssignmentStatus.SKIPPED)
+        self.assertEqual(len(skipped), 7)
+
+    def test_batch_claims_queries_do_not_grow_with_claims(self):
+        service, claims, claim_sampling = self._create_test_batch()
+        fields = 'uuid assignmentStatus claimSamplingBatchId clientMutationId'
+        listings = {
+            'samplingBatchClaims': ('{ edges { node { %s } } }' % fields,
+                                    lambda data: [edge['node'] for edge in data['edges']]),
+            'samplingBatchClaimsPage': ('{ claims { %s } }' % fields, lambda data: data['claims']),
+        }
+
+        def count_queries(listing, first):
+            selection, nodes_of = listings[listing]
+            query = f'{{ {listing}(claimSamplingId: "{claim_sampling.id}", first: {first}) {selection} }}'
+            with CaptureQueriesContext(connection) as queries:
+                response = self.query(query, headers={"HTTP_AUTHORIZATION": f"Bearer {self.admin_token}"})
+            self.assertResponseNoErrors(response)
+            nodes = nodes_of(json.loads(response.content)['data'][listing])
+            self.assertEqual(len(nodes), first)
+            self.assertEqual({node['claimSamplingBatchId'] for node in nodes}, {str(claim_sampling.id)})
+            return len(queries)
+
+        for listing in listings:
+            self.assertEqual(count_queries(listing, 2), count_queries(listing, 10))
+
+    def test_batch_claims_queryset_has_no_subquery(self):
+        service, claims, claim_sampling = self._create_test_batch()
+        # Two claims of the batch are moved to a health facility in a district the user has no access to
+        other_district = create_test_village().parent.parent
+        other_hf = create_test_health_facility("2", other_district.id, valid=True)
+        out_of_scope = list(claims.order_by('id').values_list('id', flat=True)[:2])
+        Claim.objects.filter(id__in=out_of_scope).update(health_facility=other_hf)
+        district_user = create_test_interactive_user(
+            username="testSamplingDistrictUser",
+            roles=[create_test_role([], name="ClaimSamplingDistrictRole").id]
+        )
+        assign_user_districts(district_user, [self.test_district.code])
+
+        batch_claims = Claim.objects.filter(assignments__claim_batch=claim_sampling).order_by('status', 'id')
+        with self.settings(ROW_SECURITY=True):
+            queryset = ClaimSamplingBatchGQLType.get_queryset(batch_claims, district_user)
+            sql = str(queryset.query).upper()
+            claim_ids = set(queryset.values_list('id', flat=True))
+
+        self.assertNotIn('IN (SELECT', sql)
+        self.assertEqual(claim_ids, set(claims.exclude(id__in=out_of_scope).values_list('id', flat=True)))
+
+    def test_export_batch_rows(self):
+        service, claims, claim_sampling = self._create_test_batch()
+
+        rows = list(service.export_batch_rows(claim_sampling.id))
+
+        self.assertEqual(len(rows), 10)
+        self.assertTrue(all(len(row) == len(BATCH_EXPORT_COLUMNS) for row in rows))
+        self.assertEqual({row[0] for row in rows}, set(claims.values_list('uuid', flat=True)))
+        self.assertEqual(sum(row[2] == ClaimSamplingBatchAssignmentStatus.IDLE for row in rows), 3)
+
+    def test_released_batch_claims_are_not_listed(self):
+        service, claims, claim_sampling = self._create_test_batch()
+        service._release_sampling_batch(claim_sampling, 'released by test')
+
+        page, end_cursor, has_next_page = service.get_batch_claims_page(claim_sampling.id)
+
+        self.assertEqual(page, [])
+        self.assertFalse(has_next_page)
+        self.assertEqual(list(service.export_batch_rows(claim_sampling.id)), [])
+
+    def test_export_batch_rejects_missing_and_unknown_batches(self):
+        factory = APIRequestFactory()
+
+        def export(**params):
+            request = factory.get('/export/', params)
+            force_authenticate(request, user=self.admin_user)
+            return export_batch(request)
+
+        self.assertEqual(export().status_code, 400)
+        self.assertEqual(export(uuid='not-a-uuid').status_code, 400)
+        self.assertEqual(export(uuid=str(uuid.uuid4())).status_code, 404)
+
+    def test_extrapolate_task_in_background(self):
+        service, claims, claim_sampling = self._create_test_batch()
+        task = Task.objects.get(entity_id=str(claim_sampling.id))
+
+        with mock.patch.object(ClaimSamplingConfig, 'background_executor_workers', 0), \
+                self.captureOnCommitCallbacks(execute=True):
+            service.extrapolate_task_async(task.id)
+            task.refresh_from_db()
+            self.assertEqual(task.json_ext['extrapolation']['status'], 'QUEUED')
+
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.Status.COMPLETED)
+        self.assertEqual(task.json_ext['extrapolation']['status'], 'COMPLETED')
+
+    def test_failed_task_extrapolation(self):
+        service, claims, claim_sampling = self._create_test_batch()
+        task = Task.objects.get(entity_id=str(claim_sampling.id))
+
+        with mock.patch.object(ClaimSamplingService, 'extrapolate_results', side_effect=ValueError('deductible')):
+            service.extrapolate_task(task.id)
+
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.Status.FAILED)
+        self.assertEqual(task.json_ext['extrapolation'], {'status': 'FAILED', 'error': 'deductible'})
+
+    def test_task_completion_failure_is_logged(self):
+        service, claims, claim_sampling = self._create_test_batch()
+        task = Task.objects.get(entity_id=str(claim_sampling.id))
+        failure = {'success': False, 'message': 'Failed to complete Task', 'detail': 'locked', 'data': ''}
+
+        with mock.patch.object(TaskService, 'complete_task', return_value=failure), \
+                self.assertLogs('claim_sampling.services', level='ERROR') as logs:
+            service.extrapolate_task(task.id)
+
+        self.assertIn('locked', logs.output[0])
+        task.refresh_from_db()
+        self.assertEqual(task.json_ext['extrapolation']['status'], 'COMPLETED')
+
+    def test_streamed_selection_matches_percentage(self):
+        service = ClaimSamplingService(self.admin_user)
+        claims = Claim.objects.filter(id__in=[claim.id for claim in self.test_claims])
+
+        claim_sampling = service.create_streaming(
+            {'percentage': 30, 'uuids': claims.values_list('uuid', flat=True), 'chunk_size': 3})
+
+        assignments = ClaimSamplingBatchAssignment.objects.filter(claim_batch=claim_sampling)
+        self.assertEqual(assignments.count(), 10)
+        self.assertEqual(assignments.filter(status=ClaimSamplingBatchAssignmentStatus.IDLE).count(), 3)
+        self.assertEqual(service.get_progress(claim_sampling.id)['selected'], 3)
+
+    def test_failed_streaming_releases_claims(self):
+        service = ClaimSamplingService(self.admin_user)
+        claims = Claim.objects.filter(id__in=[claim.id for claim in self.test_claims])
+
+        with mock.patch.object(ClaimSamplingService, '_create_sampling_task', side_effect=ValueError('task')):
+            with self.assertRaises(ValueError):
+                service.create_streaming(
+                    {'percentage': 30, 'uuids': claims.values_list('uuid', flat=True), 'chunk_size': 3})
+
+        claim_sampling = ClaimSamplingBatch.objects.get()
+        self.assertEqual(service.get_progress(claim_sampling.id)['status'], 'FAILED')
+        self.assertFalse(ClaimSamplingBatchAssignment.objects.filter(is_deleted=False).exists())
+        self.assertFalse(claims.filter(review_status=Claim.REVIEW_SELECTED).exists())
+        # The claims can be sampled again
+        _, _, claim_sampling = self._create_test_batch()
+        self.assertEqual(ClaimSamplingBatchAssignment.objects.filter(claim_batch=claim_sampling).count(), 10)
+
+    def test_seeded_sample_is_reproducible(self):
+        def seeded_selection(seed):
+            service, _, claim_sampling = self._create_test_batch(seed=seed)
+            selected = set(ClaimSamplingBatchAssignment.objects.filter(
+                claim_batch=claim_sampling, status=ClaimSamplingBatchAssignmentStatus.IDLE
+            ).values_list('claim_id', flat=True))
+            self.assertEqual(set(service.derive_seeded_sample(claim_sampling.id).values_list('id', flat=True)),
+                             selected)
+            # Frees the claims for the next batch
+            service._release_sampling_batch(claim_sampling, 'released by test')
+            return selected
+
+        first = seeded_selection('audit-2024')
+        self.assertEqual(len(first), 3)
+        self.assertEqual(seeded_selection('audit-2024'), first)
+        # Three claims out of ten, other seeds can't all draw the same ones
+        self.assertTrue(any(seeded_selection(seed) != first for seed in ('audit-2025', 'audit-2026', 'audit-2027')))
+
+    def test_seeded_stratified_sample(self):
+        def stratified_selection():
+            service, _, claim_sampling = self._create_test_batch(strata=['care_type'], seed='audit')
+            selected = set(ClaimSamplingBatchAssignment.objects.filter(
+                claim_batch=claim_sampling, status=ClaimSamplingBatchAssignmentStatus.IDLE
+            ).values_list('claim_id', flat=True))
+            service._release_sampling_batch(claim_sampling, 'released by test')
+            return selected
+
+        self.assertEqual(stratified_selection(), stratified_selection())
+
+    def test_monetary_unit_and_strata_are_rejected(self):
+        with self.assertRaises(ValueError):
+            self._create_test_batch(monetary_unit=True, strata=['health_facility'])
+        self.assertFalse(ClaimSamplingBatch.objects.exists())
+
+    def test_monetary_unit_sample_follows_amounts(self):
+        large_claim = self.test_claims[4]
+        Claim.objects.filter(id=large_claim.id).update(claimed=100000)
+        service, claims, claim_sampling = self._create_test_batch(monetary_unit=True, seed='audit')
+
+        claim_sampling.refresh_from_db()
+        sampling = claim_sampling.computed_value['sampling']
+        self.assertAlmostEqual(sampling['interval'], 118000 / 3)
+        # A claim is reviewed when one of the units drawn every interval from the start falls in its amount
+        expected, cumulative, next_unit = set(), 0.0, sampling['start']
+        for claim_id, claimed in claims.order_by('id').values_list('id', 'claimed'):
+            cumulative += float(claimed)
+            if next_unit < cumulative:
+                expected.add(claim_id)
+                while next_unit < cumulative:
+                    next_unit += sampling['interval']
+        selected = set(ClaimSamplingBatchAssignment.objects.filter(
+            claim_batch=claim_sampling, status=ClaimSamplingBatchAssignmentStatus.IDLE
+        ).values_list('claim_id', flat=True))
+        self.assertEqual(selected, expected)
+        # Larger than the sampling interval, the claim is always reviewed
+        self.assertIn(large_claim.id, selected)
+
+    def test_monetary_unit_deductible_is_weighted(self):
+        large_claim, small_claim = self.test_claims[4], self.test_claims[5]
+        Claim.objects.filter(id=large_claim.id).update(claimed=100000)
+        service, claims, claim_sampling = self._create_test_batch(monetary_unit=True)
+        assignments = ClaimSamplingBatchAssignment.objects.filter(claim_batch=claim_sampling)
+        assignments.update(status=ClaimSamplingBatchAssignmentStatus.SKIPPED)
+        assignments.filter(claim__in=[large_claim, small_claim]).update(status=ClaimSamplingBatchAssignmentStatus.IDLE)
+        claims.filter(id__in=[large_claim.id, small_claim.id]).update(review_status=Claim.REVIEW_DELIVERED)
+        for model in (ClaimItem, ClaimService):
+            model.objects.filter(claim__in=claims).update(price_adjusted=1000, price_approved=1000)
+            model.objects.filter(claim=large_claim).update(price_approved=500)
+
+        deductible = service._monetary_unit_deductible(claims, {'interval': 40000})
+
+        # Weights 1 for the large claim (approved 1000, adjusted 2000) and 40000 / 2000 for the small one (2000, 2000)
+        self.assertAlmostEqual(deductible, (1000 + 20 * 2000) / (2000 + 20 * 2000))
+
+    def test_create_async_reports_progress(self):
+        service = ClaimSamplingService(self.admin_user)
+        claims = Claim.objects.filter(id__in=[claim.id for claim in self.test_claims])
+
+        with mock.patch.object(ClaimSamplingConfig, 'background_executor_workers', 0), \
+                self.captureOnCommitCallbacks(execute=True):
+            claim_sampling = service.create_async({'percentage': 30, 'uuids': claims.values_list('uuid', flat=True)})
+            self.assertEqual(service.get_progress(claim_sampling.id), {'status': 'QUEUED'})
+
+        self.assertEqual(service.get_progress(claim_sampling.id),
+                         {'status': 'COMPLETED', 'scanned': 10, 'assigned': 10, 'selected': 3})
+        self.assertTrue(Task.objects.filter(entity_id=str(claim_sampling.id)).exists())
+
+    def test_failed_create_async_releases_claims(self):
+        service = ClaimSamplingService(self.admin_user)
+        claims = Claim.objects.filter(id__in=[claim.id for claim in self.test_claims])
+
+        with mock.patch.object(ClaimSamplingConfig, 'background_executor_workers', 0), \
+                mock.patch.object(ClaimSamplingService, '_create_sampling_task', side_effect=ValueError('task')), \
+                self.captureOnCommitCallbacks(execute=True):
+            claim_sampling = service.create_async({
+                'percentage': 30, 'uuids': claims.values_list('uuid', flat=True), 'streaming': True
+            })
+
+        progress = service.get_progress(claim_sampling.id)
+        self.assertEqual((progress['status'], progress['error']), ('FAILED', 'task'))
+        self.assertFalse(ClaimSamplingBatchAssignment.objects.filter(is_deleted=False).exists())
+        self.assertFalse(claims.filter(review_status=Claim.REVIEW_SELECTED).exists())
+
+    def test_claims_of_active_batches_are_skipped(self):
+        service = ClaimSamplingService(self.admin_user)
+        first_claims = Claim.objects.filter(id__in=[claim.id for claim in self.test_claims[:5]])
+        first_batch = service.create({'percentage': 30, 'uuids': first_claims.values_list('uuid', flat=True)})
+
+        _, claims, second_batch = self._create_test_batch()
+
+        self.assertEqual(ClaimSamplingBatchAssignment.objects.filter(claim_batch=second_batch).count(), 5)
+        # Claims assigned concurrently are skipped by the insert itself
+        service._create_assignments(second_batch, [self.test_claims[0].id], [ClaimSamplingBatchAssignmentStatus.IDLE])
+        self.assertEqual(
+            list(ClaimSamplingBatchAssignment.objects.filter(claim=self.test_claims[0], is_deleted=False)
+                 .values_list('claim_batch_id', flat=True)),
+            [first_batch.id]
+        )
+
+    def _create_test_batch(self, percentage=30, **options):
+        service = ClaimSamplingService(self.admin_user)
+        claims = Claim.objects.filter(id__in=[claim.id for claim in self.test_claims])
+        claim_sampling = service.create({'percentage': percentage, 'uuids': claims.values_list('uuid', flat=True),
+                                         **options})
+        return service, claims, claim_sampling
+
     def _get_test_dict(self, code=None):
         return {
             "health_facility_id": self.test_claim.health_facility_id,
@@ -264,3 +848,49 @@ mutation {{
                 "audit_user_id": self.test_claim_service.audit_user_id
             }]
         }
+
+
+class StratifiedAllocationTestCase(TestCase):
+    strata = [
+        {'population': 900, 'stddev': 10},
+        {'population': 90, 'stddev': 100},
+        {'population': 10, 'stddev': 0},
+    ]
+
+    def test_proportional_allocation(self):
+        allocations = allocate_stratified_sample(self.strata, 100)
+        self.assertEqual(allocations, [90, 9, 1])
+
+    def test_neyman_allocation(self):
+        allocations = allocate_stratified_sample(self.strata, 100, 'neyman')
+        # Weights 9000 and 9000, the stratum without variance still gets one claim, taken from the others
+        self.assertEqual(allocations, [49, 50, 1])
+
+    def test_allocation_capped_by_sample_size(self):
+        # More strata than claims to select, the smallest strata get none
+        allocations = allocate_stratified_sample([{'population': 1}] * 5 + [{'population': 20}], 3)
+        self.assertEqual(sum(allocations), 3)
+        self.assertEqual(allocations[-1], 1)
+
+    def test_allocation_capped_by_population(self):
+        allocations = allocate_stratified_sample([{'population': 2}, {'population': 50}], 40)
+        self.assertEqual(allocations, [2, 38])
+
+
+class RatioEstimateTestCase(TestCase):
+    def test_ratio_and_intervals(self):
+        estimate = ratio_estimate([50, 80, 100, 90], [100, 100, 100, 100], seed=1)
+        self.assertAlmostEqual(estimate['ratio'], 0.8)
+        # Residuals -30, 0, 20, 10, linearized variance 4/3 * 1400 / 400^2
+        self.assertAlmostEqual(estimate['variance'], 4 / 3 * 1400 / 400 ** 2)
+        self.assertLess(estimate['ci_low'], 0.8)
+        self.assertGreater(estimate['ci_high'], 0.8)
+        self.assertTrue(0.5 <= estimate['bootstrap_low'] <= 0.8 <= estimate['bootstrap_high'] <= 1.0)
+
+    def test_finite_population_correction(self):
+        estimate = ratio_estimate([50, 80, 100, 90], [100, 100, 100, 100], population=4, bootstrap_samples=0)
+        self.assertEqual(estimate['variance'], 0)
+        self.assertIsNone(estimate['bootstrap_low'])
+
+    def test_no_adjusted_amount(self):
+        self.assertIsNone(ratio_estimate([], []))
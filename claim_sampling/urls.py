@@ -1 +1,6 @@
-urlpatterns = []
+from django.urls import path
+from claim_sampling import views
+
+urlpatterns = [
+    path("export/", views.export_batch, name="export_batch"),
+]
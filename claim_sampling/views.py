@@ -1,3 +1,139 @@
-from django.shortcuts import render
+import csv
+import io
+import uuid
+from itertools import islice
 
-# Create your views here.
+from django.http import StreamingHttpResponse
+from django.utils.translation import gettext as _
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
+
+from claim.models import Claim
+from core.security import checkUserWithRights
+from .apps import ClaimSamplingConfig
+from .models import ClaimSamplingBatch
+from .services import ClaimSamplingService, BATCH_EXPORT_COLUMNS
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet exports are optional
+    pyarrow = None
+
+EXPORT_FORMAT_CSV = 'csv'
+EXPORT_FORMAT_PARQUET = 'parquet'
+
+
+@api_view(["GET"])
+@permission_classes(
+    [
+        checkUserWithRights(
+            ClaimSamplingConfig.gql_query_claim_batch_samplings_perms,
+        )
+    ]
+)
+def export_batch(request):
+    """
+    Streams the claims of a sampling batch (`uuid` parameter) with their assignment status, amounts and review
+    outcome, as CSV or as Parquet (`format` parameter) when pyarrow is installed. Rows are written as they are read
+    from the database, the first bytes are sent before the whole batch is read.
+    """
+    export_format = request.query_params.get("format", EXPORT_FORMAT_CSV)
+    if export_format == EXPORT_FORMAT_PARQUET and pyarrow is None:
+        return Response(data=_("Parquet export requires pyarrow."), status=status.HTTP_400_BAD_REQUEST)
+    if export_format not in (EXPORT_FORMAT_CSV, EXPORT_FORMAT_PARQUET):
+        return Response(data=_("Unsupported file format."), status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        claim_sampling_id = uuid.UUID(request.query_params.get("uuid", ""))
+    except ValueError:
+        return Response(data=_("A valid sampling batch uuid is required."), status=status.HTTP_400_BAD_REQUEST)
+    # Checked before streaming starts, the status can't be changed once the first bytes are sent
+    if not ClaimSamplingBatch.objects.filter(id=claim_sampling_id, is_deleted=False).exists():
+        return Response(data=_("Sampling batch not found."), status=status.HTTP_404_NOT_FOUND)
+
+    rows = ClaimSamplingService(request.user).export_batch_rows(
+        claim_sampling_id, Claim.get_queryset(None, request.user))
+    if export_format == EXPORT_FORMAT_PARQUET:
+        content, content_type = _parquet_chunks(rows), "application/vnd.apache.parquet"
+    else:
+        content, content_type = _csv_chunks(rows), "text/csv"
+    return StreamingHttpResponse(
+        content,
+        content_type=content_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="claim_sampling_{claim_sampling_id}.{export_format}"'
+        },
+    )
+
+
+def _row_chunks(rows):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, ClaimSamplingConfig.export_chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(BATCH_EXPORT_COLUMNS)
+    # The header goes out before the first rows are read
+    yield buffer.getvalue()
+    for chunk in _row_chunks(rows):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+
+
+class _ParquetSink:
+    """
+    Write-only file collecting what pyarrow writes until it is sent, the position written so far is kept because
+    Parquet metadata refers to offsets in the whole file.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def pop(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def _parquet_chunks(rows):
+    amount = pyarrow.decimal128(38, 6)
+    schema = pyarrow.schema([
+        ('claim_uuid', pyarrow.string()), ('claim_code', pyarrow.string()), ('assignment_status', pyarrow.string()),
+        ('status', pyarrow.int16()), ('review_status', pyarrow.int16()),
+        ('claimed', amount), ('approved', amount), ('adjusted', amount),
+    ])
+    sink = _ParquetSink()
+    # Each chunk of rows is a row group, sent as soon as it is written
+    with pyarrow.parquet.ParquetWriter(pyarrow.PythonFile(sink, mode='w'), schema) as writer:
+        yield sink.pop()
+        for chunk in _row_chunks(rows):
+            writer.write_batch(pyarrow.RecordBatch.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(zip(*chunk), schema)], schema=schema
+            ))
+            yield sink.pop()
+    yield sink.pop()
@@ -24,8 +24,12 @@ setup(
         'django-db-signals',
         'djangorestframework',
         'openimis-be-core',
-        'openimis-be-claim'
+        'openimis-be-claim',
+        'numpy'
     ],
+    extras_require={
+        'parquet': ['pyarrow'],
+    },
     classifiers=[
         'Environment :: Web Environment',
         'Framework :: Django',